@@ -1,12 +1,19 @@
+from collections import deque
 from typing import List, Dict, Any, Optional, Tuple
 from dataclasses import asdict, is_dataclass
+from operator import attrgetter
+import numpy as np
 import pandas as pd
 
 from models import Settings
-from scoring import amount_A, dealer_bonus_tai
+from scoring import DEALER_BONUS_TAI, amount_table, dealer_bonus_tai
 
 # 常數（僅用於顯示標籤）
 WINDS = ["東", "南", "西", "北"]
+STAT_FIELDS = ("自摸", "胡", "放槍", "詐胡", "詐摸")
+# 累計狀態裡的 stats 是攤平的 int list：玩家 pid 的欄位 k 在 stats[pid * N_STATS + k]
+STAT_SELFDRAW, STAT_HU, STAT_FANG, STAT_ZHAHU, STAT_ZHAMO = range(len(STAT_FIELDS))
+N_STATS = len(STAT_FIELDS)
 
 
 def safe_int(x: Any, default: int = 0) -> int:
@@ -16,16 +23,58 @@ def safe_int(x: Any, default: int = 0) -> int:
         return default
 
 
+_HAND_FIELDS = (("result", ""), ("winner_id", None), ("loser_id", None), ("tai", 0))
+_PENALTY_FIELDS = (("p_type", ""), ("offender_id", 0), ("victim_id", 0), ("amount", 0))
+_get_hand_fields = attrgetter(*(f for f, _ in _HAND_FIELDS))
+_get_penalty_fields = attrgetter(*(f for f, _ in _PENALTY_FIELDS))
+
+
+def _project(ev: Any, ev_type: str, getter, fields) -> Dict[str, Any]:
+    try:
+        values = getter(ev)
+    except AttributeError:
+        # 欄位不齊的舊物件才逐一 getattr 補預設值
+        values = tuple(getattr(ev, f, default) for f, default in fields)
+    d = {"_type": ev_type}
+    d.update(zip((f for f, _ in fields), values))
+    return d
+
+
+def _project_hand(ev: Any) -> Dict[str, Any]:
+    return _project(ev, "hand", _get_hand_fields, _HAND_FIELDS)
+
+
+def _project_penalty(ev: Any) -> Dict[str, Any]:
+    return _project(ev, "penalty", _get_penalty_fields, _PENALTY_FIELDS)
+
+
+# 非 dict 事件（dataclass / 物件）依 _type 直接投影成 dict，不走 asdict 反射
+_EV_PROJECTORS = {"hand": _project_hand, "penalty": _project_penalty}
+
+
+def _is_normalized(ev: Dict[str, Any]) -> bool:
+    """已帶正確 _type 的 dict（錄入 / 載入時就轉好了）可直接沿用，不必再複製。"""
+    t = ev.get("_type")
+    if t == "hand":
+        return "result" in ev
+    if t == "penalty":
+        return "p_type" in ev and "result" not in ev
+    return False
+
+
 def ev_to_dict(ev: Any) -> Dict[str, Any]:
     if isinstance(ev, dict):
+        if _is_normalized(ev):
+            return ev  # 已是標準格式：呼叫端只讀，不必複製
         d = dict(ev)
-    elif is_dataclass(ev):
-        d = asdict(ev)
     else:
-        d: Dict[str, Any] = {}
-        for k in ("result", "winner_id", "loser_id", "tai", "p_type", "offender_id", "victim_id", "amount"):
-            if hasattr(ev, k):
-                d[k] = getattr(ev, k)
+        ev_type = getattr(ev, "_type", None)
+        if ev_type is None:
+            ev_type = "hand" if hasattr(ev, "result") else ("penalty" if hasattr(ev, "p_type") else None)
+        project = _EV_PROJECTORS.get(ev_type)
+        if project is not None:
+            return project(ev)
+        d = asdict(ev) if is_dataclass(ev) else {}
     if "result" in d:
         d["_type"] = "hand"
     elif "p_type" in d:
@@ -36,7 +85,8 @@ def ev_to_dict(ev: Any) -> Dict[str, Any]:
 
 
 def normalize_events(events: List[Any]) -> List[Dict[str, Any]]:
-    return [ev_to_dict(e) for e in events]
+    # compute_game_state 只讀不寫，已正規化的 dict 直接共用
+    return [e if isinstance(e, dict) and _is_normalized(e) else ev_to_dict(e) for e in events]
 
 
 def hand_label(rw_idx: int, dealer_seat: int) -> str:
@@ -45,98 +95,166 @@ def hand_label(rw_idx: int, dealer_seat: int) -> str:
     return f"{WINDS[min(rw_idx, 3)]}{dealer_seat + 1}局"
 
 
-def compute_game_state(settings: Settings, events_raw: List[Any]):
-    events = normalize_events(events_raw)
+# 事件迴圈用的查表：_HAND_LABELS[rw][ds]（迴圈內 rw < 4，已結束的事件另外處理）
+_HAND_LABELS: Tuple[Tuple[str, ...], ...] = tuple(tuple(hand_label(r, d) for d in range(4)) for r in range(4))
+
+
+# 過莊查表：下一個莊家座位，以及北家下莊時圈風 +1（取代取餘數 + 判斷）
+_NEXT_SEAT = (1, 2, 3, 0)
+_ROUND_WRAP = (0, 0, 0, 1)
+
+
+# 「一家對三家」收付（自摸、詐摸）：center 為收錢（自摸）或付錢（詐摸，金額帶負號）的那一家。
+# 莊家付 dealer_amt、其餘閒家各付 other_amt，center 收兩者總和；center 就是莊家時兩份金額相同。
+def _one_vs_three(n: int, center: int, dealer_pid: int, dealer_amt: int, other_amt: int) -> List[int]:
+    # 先整列填閒家那份，再覆寫莊家 / center 兩格（不逐家判斷角色）
+    delta = [-other_amt] * n
+    delta[dealer_pid] = -dealer_amt
+    if 0 <= center < n:
+        delta[center] = dealer_amt + 2 * other_amt
+    return delta
+
+
+def new_game_acc(debug: bool = True, debug_keep: Optional[int] = None) -> Dict[str, Any]:
+    """
+    空的累計狀態；advance_game_acc 只處理尚未處理過的事件，可跨 rerun 重複使用。
+    debug=False 時不產生 debug 文字；debug_keep 指定時只保留最後這麼多筆（長局不會無限增長）。
+    """
+    n = 4
+    return {
+        "count": 0,
+        "rw": 0, "ds": 0, "dr": 0, "d_acc": 0,
+        "cum": [0] * n,  # 目前總分；只需要總分的呼叫端不必組 DataFrame
+        "stats": [0] * (n * N_STATS),  # 見 STAT_* 索引
+        # 每筆事件只記錄 delta（攤平成一維：第 i 筆在 [4i, 4i+4)）；累計分數在 finalize 時用 np.cumsum 一次算出
+        "delta_rows": [],
+        "labels": [],
+        "descs": [],
+        # (文字, 事件列索引)：cum 要等 cumsum 後才補上；索引為 None 表示不附 cum
+        "debug_parts": (deque(maxlen=debug_keep) if debug_keep else []) if debug else None,
+        # 每筆事件處理完的 (rw, ds, dr, d_acc)，攤平成一維；撤銷時直接查表退回，不必重播
+        "states": [],
+        # 每筆事件對 stats 加過 1 的索引；撤銷時逐項扣回
+        "stat_log": [],
+    }
+
+
+def advance_game_acc(settings: Settings, acc: Dict[str, Any], events_raw: List[Any]) -> None:
+    """
+    把 events_raw[acc["count"]:] 逐筆套用到 acc（前面的事件必須與上次相同）。
+    每次 rerun 通常只有 0～1 筆新事件，且每筆都要產生說明文字，所以維持純 Python；
+    累計分數矩陣在 finalize_game_acc 用 np.cumsum 一次算。
+    """
+    start = acc["count"]
+    events = normalize_events(events_raw[start:])
 
     n = 4
     names = settings.players
     seat_players = settings.seat_players
 
-    cum = [0] * n
-    rows: List[Dict[str, Any]] = []
-
-    rw, ds, dr, d_acc = 0, 0, 0, 0
-    debug_steps: List[str] = []
-
-    stats = {pid: {"自摸": 0, "胡": 0, "放槍": 0, "詐胡": 0, "詐摸": 0} for pid in range(n)}
+    delta_rows: List[int] = acc["delta_rows"]
+    labels: List[str] = acc["labels"]
+    descs: List[str] = acc["descs"]
+    debug_parts = acc["debug_parts"]  # list / deque of (文字, 事件列索引)
+    stats: List[int] = acc["stats"]
+    states: List[int] = acc["states"]
+    stat_log: List[Tuple[int, ...]] = acc["stat_log"]
+
+    auto_bonus = bool(settings.auto_dealer_bonus)
+    # 台數 → 金額、連莊數 → 莊家台 都先查表；超出表的範圍才呼叫函式
+    amounts = amount_table(settings)
+    n_amounts = len(amounts)
+    n_bonus = len(DEALER_BONUS_TAI)
+    # 設定值只在這裡轉一次 int，迴圈內直接用
+    tai_value = int(settings.tai_value)
+    base = amounts[0]  # == amount_A(settings, 0)；查表範圍外直接用 base + tai * tai_value，不再呼叫 amount_A
+    draw_keep = bool(settings.draw_keeps_dealer)
+    host_pid = int(settings.host_player_id)
+    dong_per = int(settings.dong_per_self_draw)
+    dong_cap = int(settings.dong_cap_total)
+    rw, ds, dr, d_acc = acc["rw"], acc["ds"], acc["dr"], acc["d_acc"]
+    cum = acc["cum"]  # 就地更新
 
     def advance_dealer():
         nonlocal rw, ds, dr
-        ds = (ds + 1) % 4
+        rw += _ROUND_WRAP[ds]
+        ds = _NEXT_SEAT[ds]
         dr = 0
-        if ds == 0:
-            rw += 1
 
-    for idx, ev in enumerate(events, start=1):
+    for idx, ev in enumerate(events, start=start + 1):
         delta = [0] * n
         label = ""
         desc = ""
+        inc: Tuple[int, ...] = ()
 
         if rw >= 4:
             ev_type = ev.get("_type", "unknown")
             label = "⚠️ 已結束"
             desc = f"忽略事件：本將已結束 (type={ev_type})"
-            debug_steps.append(f"[ignored] idx={idx} rw={rw} ds={ds} dr={dr} type={ev_type}")
-
-            row = {"#": idx, "類型": label, "說明": desc}
-            for p in range(n):
-                row[names[p]] = cum[p]
-            rows.append(row)
+            if debug_parts is not None:
+                debug_parts.append((f"[ignored] idx={idx} rw={rw} ds={ds} dr={dr} type={ev_type}", None))
+
+            delta_rows.extend((0, 0, 0, 0))
+            labels.append(label)
+            descs.append(desc)
+            states.extend((rw, ds, dr, d_acc))
+            stat_log.append(inc)
             continue
 
         dealer_pid = seat_players[ds]
-        bonus = dealer_bonus_tai(dr)
+        bonus = DEALER_BONUS_TAI[dr] if dr < n_bonus else dealer_bonus_tai(dr)
 
         if ev.get("_type") == "hand":
-            label = hand_label(rw, ds)
+            label = _HAND_LABELS[rw][ds]
 
             result = ev.get("result", "")
-            w = safe_int(ev.get("winner_id"), default=-1)
-            l = safe_int(ev.get("loser_id"), default=-1)
-            tai = safe_int(ev.get("tai", 0))
-            A = amount_A(settings, tai)
+            # 錄入 / 載入的事件欄位本來就是 int，直接用；只有舊資料或外部輸入（None、字串）才走 safe_int
+            # （type(x) is int 不含 bool，True / False 仍交給 safe_int 轉成 1 / 0）
+            w = ev.get("winner_id")
+            w = w if type(w) is int else safe_int(w, default=-1)
+            l = ev.get("loser_id")
+            l = l if type(l) is int else safe_int(l, default=-1)
+            tai = ev.get("tai", 0)
+            tai = tai if type(tai) is int else safe_int(tai)
 
             if result == "流局":
                 desc = "流局"
-                if settings.draw_keeps_dealer:
+                if draw_keep:
                     dr += 1
                 else:
                     advance_dealer()
 
             elif result == "自摸":
                 if 0 <= w < n:
-                    stats[w]["自摸"] += 1
+                    i = w * N_STATS + STAT_SELFDRAW
+                    stats[i] += 1
+                    inc = (i,)
+
+                # 金額用算式決定，不再分莊 / 閒兩套分支：
+                # 莊家那份 = tai+莊家台（莊自摸且未開自動加台時不加）；莊自摸時三家同額，閒自摸時其他閒家付 A
+                w_is_dealer = w == dealer_pid
+                pay_tai = tai + bonus if (auto_bonus or not w_is_dealer) else tai
+                dealer_pay = amounts[pay_tai] if 0 <= pay_tai < n_amounts else base + pay_tai * tai_value
+                if w_is_dealer:
+                    other_pay = dealer_pay
+                else:
+                    # 牌型台金額 A 只有閒家自摸（其他閒家付）用得到，其他結果不必查
+                    other_pay = amounts[tai] if 0 <= tai < n_amounts else base + tai * tai_value
+                delta = _one_vs_three(n, w, dealer_pid, dealer_pay, other_pay)
 
-                if w == dealer_pid:
-                    auto_bonus = bool(getattr(settings, "auto_dealer_bonus", True))
-                    eff_tai = tai + bonus if auto_bonus else tai
-                    A_dealer = amount_A(settings, eff_tai)
+                if w_is_dealer:
                     desc = f"{names[w]} 自摸({tai}+{bonus}台) [莊]" if auto_bonus else f"{names[w]} 自摸({tai}台) [莊]"
-                    for p in range(n):
-                        if p == w:
-                            delta[p] += 3 * A_dealer
-                        else:
-                            delta[p] -= A_dealer
                     dr += 1
                 else:
-                    dealer_pay = amount_A(settings, tai + bonus)
-                    other_pay = A
                     desc = f"{names[w]} 自摸({tai}台) [閒] (莊付{tai}+{bonus}台)"
-                    for p in range(n):
-                        if p == w:
-                            delta[p] += dealer_pay + 2 * other_pay
-                        elif p == dealer_pid:
-                            delta[p] -= dealer_pay
-                        else:
-                            delta[p] -= other_pay
                     advance_dealer()
 
-                if settings.dong_per_self_draw > 0 and settings.dong_cap_total > 0:
-                    remain = max(0, int(settings.dong_cap_total) - int(d_acc))
-                    take = min(int(settings.dong_per_self_draw), remain)
+                if dong_per > 0 and dong_cap > 0:
+                    remain = max(0, dong_cap - d_acc)
+                    take = min(dong_per, remain)
                     if take > 0 and 0 <= w < n:
                         delta[w] -= take
-                        delta[int(settings.host_player_id)] += take
+                        delta[host_pid] += take
                         d_acc += take
 
             elif result in ("放槍", "胡牌"):
@@ -144,69 +262,69 @@ def compute_game_state(settings: Settings, events_raw: List[Any]):
                     desc = "錯誤：贏家與輸家不能相同"
                 else:
                     if 0 <= w < n:
-                        stats[w]["胡"] += 1
+                        i = w * N_STATS + STAT_HU
+                        stats[i] += 1
+                        inc = (i,)
                     if 0 <= l < n:
-                        stats[l]["放槍"] += 1
-
-                    if w == dealer_pid:
-                        auto_bonus = bool(getattr(settings, "auto_dealer_bonus", True))
-                        eff_tai = tai + bonus if auto_bonus else tai
-                        A_dealer = amount_A(settings, eff_tai)
+                        i = l * N_STATS + STAT_FANG
+                        stats[i] += 1
+                        inc += (i,)
+
+                    # 只有贏家、輸家兩家收付：莊家胡（開自動加台）或莊家放槍時加莊家台，其餘照牌型台
+                    w_is_dealer = w == dealer_pid
+                    pay_tai = tai + bonus if ((w_is_dealer and auto_bonus) or l == dealer_pid) else tai
+                    pay = amounts[pay_tai] if 0 <= pay_tai < n_amounts else base + pay_tai * tai_value
+                    delta[w] += pay
+                    delta[l] -= pay
+
+                    if w_is_dealer:
                         desc = f"{names[w]} 胡 {names[l]}({tai}+{bonus}台) [莊]" if auto_bonus else f"{names[w]} 胡 {names[l]}({tai}台) [莊]"
-                        delta[w] += A_dealer
-                        delta[l] -= A_dealer
                         dr += 1
                     else:
                         if l == dealer_pid:
-                            pay = amount_A(settings, tai + bonus)
                             desc = f"{names[w]} 胡 {names[l]}({tai}台) [閒胡莊] (莊付{tai}+{bonus}台)"
-                            delta[w] += pay
-                            delta[l] -= pay
                         else:
                             desc = f"{names[w]} 胡 {names[l]}({tai}台)"
-                            delta[w] += A
-                            delta[l] -= A
                         advance_dealer()
             else:
                 desc = f"未知牌局結果：{result}"
 
         elif ev.get("_type") == "penalty":
-            label = hand_label(rw, ds)
+            label = _HAND_LABELS[rw][ds]
             p_type = ev.get("p_type", "")
-            amt = safe_int(ev.get("amount", 0))
+            amt = ev.get("amount", 0)
+            amt = amt if type(amt) is int else safe_int(amt)
             dealer_paid = False
 
             if p_type == "詐胡":
-                off = safe_int(ev.get("offender_id", 0))
-                vic = safe_int(ev.get("victim_id", 0))
+                off = ev.get("offender_id", 0)
+                off = off if type(off) is int else safe_int(off)
+                vic = ev.get("victim_id", 0)
+                vic = vic if type(vic) is int else safe_int(vic)
                 if 0 <= off < n:
-                    stats[off]["詐胡"] += 1
+                    i = off * N_STATS + STAT_ZHAHU
+                    stats[i] += 1
+                    inc = (i,)
                 desc = f"{names[off]} 詐胡→{names[vic]} (${amt})"
                 delta[off] -= amt
                 delta[vic] += amt
                 dealer_paid = (off == dealer_pid)
 
             elif p_type == "詐摸":
-                off = safe_int(ev.get("offender_id", 0))
+                off = ev.get("offender_id", 0)
+                off = off if type(off) is int else safe_int(off)
                 if 0 <= off < n:
-                    stats[off]["詐摸"] += 1
+                    i = off * N_STATS + STAT_ZHAMO
+                    stats[i] += 1
+                    inc = (i,)
                 if off == dealer_pid:
                     desc = f"{names[off]} 詐摸賠三家 (每家${amt}) [莊]"
-                    delta[off] -= 3 * amt
-                    for p in range(n):
-                        if p != off:
-                            delta[p] += amt
+                    delta = _one_vs_three(n, off, dealer_pid, -amt, -amt)
                     dealer_paid = True
                 else:
-                    bonus_tai = dealer_bonus_tai(dr)
-                    dealer_extra = bonus_tai * int(settings.tai_value)
-                    other_non_dealers = [p for p in range(n) if p not in (off, dealer_pid)]
-                    for p in other_non_dealers:
-                        delta[off] -= amt
-                        delta[p] += amt
+                    dealer_extra = bonus * tai_value
                     pay_dealer = amt + dealer_extra
-                    delta[off] -= pay_dealer
-                    delta[dealer_pid] += pay_dealer
+                    delta = _one_vs_three(n, off, dealer_pid, -pay_dealer, -amt)
                     desc = f"{names[off]} 詐摸[閒]：賠莊${pay_dealer}，賠閒各${amt}"
                     dealer_paid = False
 
@@ -218,30 +336,103 @@ def compute_game_state(settings: Settings, events_raw: List[Any]):
             label = "未知"
             desc = "不支援事件"
 
-        for p in range(n):
-            cum[p] += delta[p]
-
-        row = {"#": idx, "類型": label, "說明": desc}
-        for p in range(n):
-            row[names[p]] = cum[p]
-        rows.append(row)
-
-        if rw < 4:
-            debug_dealer = names[seat_players[ds]]
-        else:
-            debug_dealer = "N/A"
-
-        debug_steps.append(f"[#{idx}] ds={ds} dealer={debug_dealer} dr={dr} rw={rw} delta={delta} cum={cum}")
-
-    ledger_df = pd.DataFrame(rows)
-    sum_df = pd.DataFrame([{"玩家": names[i], "總分": cum[i]} for i in range(n)])
-
-    stats_rows = []
-    for pid in range(n):
-        r = {"玩家": names[pid]}
-        r.update(stats[pid])
-        stats_rows.append(r)
-    stats_df = pd.DataFrame(stats_rows)
-
-    return ledger_df, sum_df, stats_df, rw, ds, dr, d_acc, debug_steps
-
+        delta_rows.extend(delta)
+        # n 固定為 4：就地累加、展開，不每筆再配置一個新 list
+        cum[0] += delta[0]
+        cum[1] += delta[1]
+        cum[2] += delta[2]
+        cum[3] += delta[3]
+        labels.append(label)
+        descs.append(desc)
+        states.extend((rw, ds, dr, d_acc))
+        stat_log.append(inc)
+
+        if debug_parts is not None:
+            debug_dealer = names[seat_players[ds]] if rw < 4 else "N/A"
+            debug_parts.append((f"[#{idx}] ds={ds} dealer={debug_dealer} dr={dr} rw={rw} delta={delta}", idx - 1))
+
+    acc.update(count=start + len(events), rw=rw, ds=ds, dr=dr, d_acc=d_acc, cum=cum)
+
+
+def truncate_game_acc(acc: Dict[str, Any], k: int) -> bool:
+    """
+    把 acc 退回「只處理了前 k 筆事件」的狀態（撤銷用）：局況查 states 表、總分扣回 delta、統計扣回 stat_log。
+    debug 文字無法逐筆退回，debug 開啟時回傳 False（呼叫端改為從頭重算）。
+    """
+    count = acc["count"]
+    if k > count or acc["debug_parts"] is not None:
+        return False
+    stats = acc["stats"]
+    for inc in acc["stat_log"][k:]:
+        for i in inc:
+            stats[i] -= 1
+    del acc["stat_log"][k:]
+
+    deltas: List[int] = acc["delta_rows"]
+    cum = acc["cum"]
+    for i in range(4 * k, len(deltas)):
+        cum[i % 4] -= deltas[i]
+    del deltas[4 * k:]
+
+    del acc["labels"][k:]
+    del acc["descs"][k:]
+    states: List[int] = acc["states"]
+    del states[4 * k:]
+    acc["rw"], acc["ds"], acc["dr"], acc["d_acc"] = states[-4:] if k else (0, 0, 0, 0)
+    acc["count"] = k
+    return True
+
+
+def stats_matrix(stats: List[int]) -> np.ndarray:
+    """攤平的 stats list → (玩家, STAT_FIELDS) 的 int64 矩陣。"""
+    return np.array(stats, dtype=np.int64).reshape(-1, N_STATS)
+
+
+def finalize_game_acc(settings: Settings, acc: Dict[str, Any]):
+    """由累計狀態組出 compute_game_state 的回傳值（ledger / 總分 / 統計三個 DataFrame；不修改 acc）。"""
+    n = 4
+    names = settings.players
+    labels = acc["labels"]
+    stats = acc["stats"]
+
+    # 一維 int list → ndarray 直接整塊轉換，不必逐列處理巢狀 list
+    cum_matrix = np.cumsum(np.fromiter(acc["delta_rows"], dtype=np.int64, count=len(acc["delta_rows"])).reshape(-1, n), axis=0)
+    cum = acc["cum"]
+    debug_steps = [
+        text if i is None else f"{text} cum={cum_matrix[i].tolist()}" for text, i in (acc["debug_parts"] or [])
+    ]
+
+    ledger_df = pd.DataFrame({
+        "#": np.arange(1, len(labels) + 1),
+        "類型": labels,
+        "說明": acc["descs"],
+        **{names[p]: cum_matrix[:, p] for p in range(n)},
+    }, copy=False)  # cum_matrix 是這裡新算出來的，欄位直接引用、不再整塊複製
+    # 直接用欄位陣列建 DataFrame，不走 list-of-dicts 的逐列推斷
+    sum_df = pd.DataFrame({"玩家": names[:n], "總分": np.array(cum, dtype=np.int64)})
+    stats_df = pd.DataFrame(stats_matrix(stats), columns=list(STAT_FIELDS))
+    stats_df.insert(0, "玩家", names[:n])
+
+    return ledger_df, sum_df, stats_df, acc["rw"], acc["ds"], acc["dr"], acc["d_acc"], debug_steps
+
+
+def summary_df(names: Any, totals: Any, stat_cols: Any) -> pd.DataFrame:
+    """
+    總分 + 行為統計合成一張表（玩家順序相同，直接用欄位陣列建表，不必 merge / concat 對齊）。
+    stat_cols 可以是 stats DataFrame 或 {欄位: 每位玩家的值}。
+    """
+    return pd.DataFrame(
+        {
+            "玩家": list(names),
+            "總分": np.asarray(totals, dtype=np.int64),
+            **{f: np.asarray(stat_cols[f], dtype=np.int64) for f in STAT_FIELDS},
+        },
+        columns=["玩家", "總分", *STAT_FIELDS],
+    )
+
+
+def compute_game_state(settings: Settings, events_raw: List[Any], *, debug: bool = False):
+    """從頭重算整將；debug=True 時才逐筆產生 debug 文字（App 走 current_game_state 的累計快取）。"""
+    acc = new_game_acc(debug)
+    advance_game_acc(settings, acc, events_raw)
+    return finalize_game_acc(settings, acc)
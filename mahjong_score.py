@@ -1,17 +1,37 @@
 # mahjong_score.py
+import base64
+import hashlib
+import importlib.util
+import itertools
 import json
+import logging
 import os
+import queue
+import threading
+import time
 import uuid
+import zlib
 from datetime import datetime
-from dataclasses import asdict, is_dataclass
+from dataclasses import asdict, fields, is_dataclass, replace
 # ✅ 確保導入 Optional, Union 等，這對後續 compute_daily_total 的參數優化很重要
-from typing import List, Dict, Any, Optional, Tuple, Union
+from typing import Callable, List, Dict, Any, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 import streamlit.components.v1 as components  # for iPhone Safari localStorage
-from models import Settings
-from engine import compute_game_state, ev_to_dict
+from models import HandEvent, PenaltyEvent, Settings
+from engine import (
+    advance_game_acc,
+    compute_game_state,
+    ev_to_dict,
+    finalize_game_acc,
+    new_game_acc,
+    normalize_events,
+    stats_matrix,
+    summary_df,
+    truncate_game_acc,
+)
 
 # Supabase
 try:
@@ -20,11 +40,67 @@ except Exception:
     create_client = None
     Client = None  # type: ignore
 
+try:
+    from supabase import ClientOptions  # type: ignore
+    import httpx  # supabase 的相依套件
+except Exception:
+    ClientOptions = None  # type: ignore
+    httpx = None  # type: ignore
+
+# st.fragment（Streamlit 1.37+；1.33–1.36 叫 experimental_fragment）：區塊內的互動只重跑該區塊
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+
+# orjson（可選）：Rust 實作的 JSON，快照序列化 / 解析比內建 json 快數倍；沒裝就用 json
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None  # type: ignore
+
+_log = logging.getLogger(__name__)
+
 APP_VERSION = "v2026-02-22_safe_6_mahjong_session"
 WINDS = ["東", "南", "西", "北"]
 
+# Supabase 資料表（建立 / 升級的 SQL 見 supabase_schema.sql）：
+#   game_states(game_id text primary key, state jsonb, updated_at timestamptz)   -- 每局一列，存最新完整快照
+#     -- 尚未升級的舊表（每次存檔 insert 一列、只有 created_at）也能用，見 _schema_compat
+#   game_events(game_id text, base text, seq int, payload jsonb, created_at timestamptz default now())
+#     -- 快照之後新增的事件；base = state.snapshot_id，seq = 事件在 events 中的位置
 SUPABASE_TABLE = "game_states"  # public.game_states
+SUPABASE_EVENTS_TABLE = "game_events"  # public.game_events
 LOCAL_SAVES_DIR = "local_saves"
+SAVE_DEBOUNCE_SECONDS = 1.0  # 背景存檔：最後一次變更後靜置這麼久才寫入（連續操作合併成一次）
+SAVE_MAX_DELAY_SECONDS = 5.0  # 持續有變更時，最晚這麼久也要寫一次
+SAVE_FLUSH_TIMEOUT_SECONDS = 15.0  # 立即存檔 / 重新載入前，最多等背景存檔寫完這麼久
+SNAPSHOT_EVERY_EVENTS = 20  # 每補寫這麼多筆事件就重新寫一次完整快照（壓實）
+LEDGER_TAIL_ROWS = 50  # 流水帳預設只送最後這麼多筆到前端，其餘要按「顯示全部」才送
+QUICK_ACTIONS = ["自摸", "胡牌", "流局", "詐胡", "詐摸"]  # 快速輸入面板的動作選項
+DEBUG_STEPS_KEEP = 30  # Debug 面板只顯示最後這麼多筆計算步驟，累計狀態也只保留這麼多
+CHART_MAX_POINTS = 200  # 走勢圖超過 2 倍這個點數時等距抽樣
+
+
+def _utc_iso(ts: Optional[float] = None) -> str:
+    """UTC ISO-8601 字串（到秒，Z 結尾）；不經過已棄用的 datetime.utcnow()。"""
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts))
+
+
+def _json_default(obj: Any) -> Any:
+    # orjson 原生支援 dataclass，只有 json 後備路徑會走到 asdict
+    return asdict(obj) if is_dataclass(obj) and not isinstance(obj, type) else str(obj)
+
+
+def _json_dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    """緊湊 UTF-8 JSON；dataclass（Settings）直接序列化，其他無法序列化的值（datetime 等）轉成字串。"""
+    if orjson is not None:
+        opt = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, default=_json_default, option=opt)
+    return json.dumps(
+        obj, ensure_ascii=False, sort_keys=sort_keys, separators=(",", ":"), default=_json_default
+    ).encode("utf-8")
+
+
+def _json_loads(raw: Union[str, bytes]) -> Any:
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
 
 
 def local_save_state(gid: str, payload: Dict[str, Any]) -> Tuple[bool, str]:
@@ -33,9 +109,9 @@ def local_save_state(gid: str, payload: Dict[str, Any]) -> Tuple[bool, str]:
         os.makedirs(LOCAL_SAVES_DIR, exist_ok=True)
         safe_gid = "".join(c for c in str(gid) if c.isalnum() or c in "_-") or "default"
         path = os.path.join(LOCAL_SAVES_DIR, f"{safe_gid}.json")
-        rec = {"state": payload, "created_at": datetime.utcnow().isoformat(timespec="seconds") + "Z"}
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(rec, f, ensure_ascii=False, indent=0)
+        rec = {"state": payload, "created_at": _utc_iso()}
+        with open(path, "wb") as f:
+            f.write(_json_dumps(rec))
         return True, "已存到本地"
     except Exception as e:
         return False, f"寫入本地失敗：{type(e).__name__}"
@@ -48,8 +124,8 @@ def local_load_latest(gid: str) -> Tuple[bool, str, Optional[Dict[str, Any]]]:
         path = os.path.join(LOCAL_SAVES_DIR, f"{safe_gid}.json")
         if not os.path.isfile(path):
             return True, "本地沒有找到資料（這是新局）", None
-        with open(path, "r", encoding="utf-8") as f:
-            rec = json.load(f)
+        with open(path, "rb") as f:
+            rec = _json_loads(f.read())
         data = rec.get("state") if isinstance(rec, dict) else None
         if not isinstance(data, dict):
             return False, "本地資料格式錯誤", None
@@ -71,7 +147,7 @@ def local_list_recent(limit: int = 10) -> List[Tuple[str, str]]:
             path = os.path.join(LOCAL_SAVES_DIR, fn)
             try:
                 mtime = os.path.getmtime(path)
-                ts = datetime.utcfromtimestamp(mtime).strftime("%Y-%m-%dT%H:%M:%SZ")
+                ts = _utc_iso(mtime)
             except Exception:
                 ts = ""
             out.append((gid, ts))
@@ -88,8 +164,9 @@ def local_list_recent(limit: int = 10) -> List[Tuple[str, str]]:
 # ============================
 # 2) Supabase Bridge
 # ============================
+@st.cache_resource(show_spinner=False)
 def _get_supabase_client() -> Optional["Client"]:
-    """Create a Supabase client from Streamlit secrets."""
+    """Create the process-wide Supabase client from Streamlit secrets (shared by all sessions)."""
     if create_client is None:
         return None
 
@@ -98,6 +175,25 @@ def _get_supabase_client() -> Optional["Client"]:
         key = st.secrets.get("SUPABASE_KEY", "")
         if not url or not key:
             return None
+    except Exception:
+        return None
+
+    # 共用 keep-alive 連線池：每次存檔/讀取不必重做 TCP+TLS 握手
+    # HTTP/2 需要 h2 套件（requirements 裝 httpx[http2]）；沒裝時仍用連線池，只是走 HTTP/1.1
+    try:
+        if ClientOptions is not None and httpx is not None:
+            pool = httpx.Client(
+                http2=importlib.util.find_spec("h2") is not None,
+                follow_redirects=True,
+                timeout=httpx.Timeout(30.0, connect=10.0),
+                limits=httpx.Limits(max_keepalive_connections=10, max_connections=20, keepalive_expiry=30.0),
+            )
+            return create_client(url, key, options=ClientOptions(httpx_client=pool))
+    except Exception:
+        # 舊版 supabase 沒有 httpx_client 選項：退回預設 client（記錄下來，不要靜默吞掉）
+        _log.warning("Supabase 連線池建立失敗，改用預設 client", exc_info=True)
+
+    try:
         return create_client(url, key)
     except Exception:
         return None
@@ -105,7 +201,9 @@ def _get_supabase_client() -> Optional["Client"]:
 
 # --- ✅ GID persistence for iPhone Safari (1+2+3) ---
 def _persist_gid_to_local_storage(gid: str) -> None:
-    """Store gid in browser localStorage."""
+    """Store gid in browser localStorage（同一 session 內 gid 沒變就不再產生 iframe）。"""
+    if st.session_state.get("_last_persisted_gid") == str(gid):
+        return
     try:
         safe_gid = str(gid).replace('"', "").replace("'", "")
         components.html(
@@ -118,6 +216,7 @@ def _persist_gid_to_local_storage(gid: str) -> None:
             """,
             height=0,
         )
+        st.session_state["_last_persisted_gid"] = str(gid)
     except Exception:
         pass
 
@@ -156,9 +255,10 @@ def _restore_gid_from_local_storage_if_missing() -> None:
 def _get_or_init_game_id() -> str:
     """
     Priority:
-    1) Use URL query param gid if present (and persist to localStorage)
+    1) Use URL query param gid if present
     2) If missing, try restore from localStorage by forcing a redirect (iPhone Safari)
-    3) If still missing, generate a new gid and write back to query params + localStorage
+    3) If still missing, generate a new gid and write back to query params
+    （寫回 localStorage 由 main() 每輪統一做一次，見 _persist_gid_to_local_storage）
     """
     # (2) If URL missing gid, try restore (may redirect)
     try:
@@ -172,9 +272,7 @@ def _get_or_init_game_id() -> str:
     try:
         gid = st.query_params.get("gid", "")
         if gid:
-            gid = str(gid)
-            _persist_gid_to_local_storage(gid)
-            return gid
+            return str(gid)
     except Exception:
         gid = ""
 
@@ -184,35 +282,103 @@ def _get_or_init_game_id() -> str:
         st.query_params["gid"] = gid
     except Exception:
         pass
-    _persist_gid_to_local_storage(gid)
     return gid
 
 
+_SETTINGS_FIELDS = tuple(f.name for f in fields(Settings))
+
+
+def settings_to_dict(s: Settings) -> Dict[str, Any]:
+    """Settings → 存檔用 dict（只有一層，list 欄位複製一份；不走 asdict 的遞迴深拷貝）。"""
+    out = {}
+    for k in _SETTINGS_FIELDS:
+        v = getattr(s, k)
+        out[k] = list(v) if isinstance(v, list) else v
+    return out
+
+
+def set_settings(s: Settings) -> None:
+    """換 / 改設定一律走這裡，同時更新存檔用的 dict 副本，snapshot_state 就不必每次重建。"""
+    st.session_state.settings = s
+    st.session_state["_settings_dict"] = settings_to_dict(s)
+    st.session_state.pop("_settings_sig", None)  # 計算快取用的設定簽章，下次用到時重算
+
+
 def snapshot_state() -> Dict[str, Any]:
-    s = st.session_state.settings
-    settings_dict = asdict(s) if is_dataclass(s) else dict(s)
+    settings_dict = st.session_state.get("_settings_dict")
+    if settings_dict is None:
+        settings_dict = settings_to_dict(st.session_state.settings)
+        st.session_state["_settings_dict"] = settings_dict
     return {
         "version": APP_VERSION,
-        "saved_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "snapshot_id": uuid.uuid4().hex,  # game_events.base 指向這個 id
+        "saved_at": _utc_iso(),
         "settings": settings_dict,
-        "events": st.session_state.get("events", []),
-        "sessions": st.session_state.get("sessions", []),
+        # 複製 list：背景執行緒寫入時，前景可能已經 append/pop
+        "events": list(st.session_state.get("events", [])),
+        "sessions": list(st.session_state.get("sessions", [])),
         "hand_active": st.session_state.get("hand_active", False),
         "hand_started_at": st.session_state.get("hand_started_at"),
         "seat_locked": st.session_state.get("seat_locked", False),
     }
 
 
+def _snapshot_meta_key() -> bytes:
+    """快照中「事件以外」部分的簽章；有變動就必須寫完整快照，不能只補事件。"""
+    s = st.session_state.settings
+    return _json_dumps(
+        {
+            "settings": s,
+            "sessions": len(st.session_state.get("sessions", [])),  # sessions 只會 append 或整個清空
+            "hand_active": st.session_state.get("hand_active", False),
+            "hand_started_at": st.session_state.get("hand_started_at"),
+            "seat_locked": st.session_state.get("seat_locked", False),
+        },
+        sort_keys=True,
+    )
+
+
+def _payload_digest(payload: Dict[str, Any]) -> bytes:
+    """快照內容雜湊（排除每次都會變的 snapshot_id / saved_at），用來略過內容相同的重複存檔。"""
+    body = {k: v for k, v in payload.items() if k not in ("snapshot_id", "saved_at")}
+    return hashlib.blake2b(_json_dumps(body, sort_keys=True), digest_size=16).digest()
+
+
+def _persist_shadow(
+    game_id: str, snapshot_id: Optional[str], base_len: Optional[int] = None, digest: Optional[bytes] = None
+) -> Dict[str, Any]:
+    """目前畫面狀態寫到雲端後的樣子（之後只需補寫新增的事件）。"""
+    events = st.session_state.get("events", [])
+    return {
+        "gid": str(game_id),
+        "snapshot_id": snapshot_id,
+        "base_len": len(events) if base_len is None else int(base_len),
+        "events": list(events),
+        "meta": _snapshot_meta_key(),
+        "digest": digest,  # 最後一份完整快照的內容雜湊；之後補寫過事件就清掉
+    }
+
+
+def _mark_persisted(
+    game_id: str, snapshot_id: Optional[str], base_len: Optional[int] = None, digest: Optional[bytes] = None
+) -> None:
+    """記錄目前畫面狀態已確定寫到哪裡（載入、同步存檔成功時）；排隊中的背景存檔一併作廢。"""
+    st.session_state["_persist"] = _persist_shadow(game_id, snapshot_id, base_len, digest)
+    st.session_state["_persist_pending"] = []
+
+
 def restore_state(data: Dict[str, Any]) -> None:
     if not data or not isinstance(data, dict):
         return
     if isinstance(data.get("settings"), dict):
         try:
-            st.session_state.settings = Settings(**data["settings"])
+            set_settings(Settings(**data["settings"]))
         except Exception:
-            st.session_state.settings = Settings()
-    st.session_state.events = data.get("events", []) or []
-    st.session_state.sessions = data.get("sessions", []) or []
+            set_settings(Settings())
+    # 載入時一次轉成標準 dict，之後每次 rerun 的 compute_game_state 直接沿用
+    st.session_state.events = normalize_events(data.get("events", []) or [])
+    _recompute_events_fp()
+    st.session_state.sessions = _compact_sessions(data.get("sessions", []) or [])
     if "hand_active" in data:
         ha = bool(data["hand_active"])
         st.session_state["hand_active"] = ha
@@ -221,94 +387,541 @@ def restore_state(data: Dict[str, Any]) -> None:
         st.session_state["seat_locked"] = bool(data["seat_locked"])
     if "hand_started_at" in data:
         st.session_state["hand_started_at"] = data["hand_started_at"]
+    _mark_persisted(st.session_state.get("game_id", ""), data.get("snapshot_id"), data.get("_snapshot_len"))
+    _mark_clean()
 
 
-def supabase_load_latest(game_id: str) -> Tuple[bool, str, Optional[Dict[str, Any]]]:
-    """Load latest state from Supabase for this game_id."""
-    sb = st.session_state.get("sb_client")
-    if sb is None:
-        return local_load_latest(game_id)
-
+def _load_event_deltas(sb: "Client", game_id: str, data: Dict[str, Any]) -> None:
+    """把快照之後補寫的事件 (game_events, base=snapshot_id) 接回 data["events"]。"""
+    snapshot_id = data.get("snapshot_id")
+    if not snapshot_id:
+        return
+    events = list(data.get("events") or [])
+    data["_snapshot_len"] = len(events)
     try:
+        res = (
+            sb.table(SUPABASE_EVENTS_TABLE)
+            .select("seq, payload")
+            .eq("game_id", game_id)
+            .eq("base", snapshot_id)
+            .order("seq")
+            .execute()
+        )
+        for r in getattr(res, "data", None) or []:
+            if int(r.get("seq", -1)) != len(events):
+                continue  # 只接連續的序號
+            ev = r.get("payload")
+            events.append(_json_loads(ev) if isinstance(ev, (str, bytes)) else ev)
+    except Exception:
+        return  # 事件表不存在 / 讀取失敗：仍使用快照本身
+    data["events"] = events
+
+
+# 舊表缺 updated_at 欄位（42703 / PGRST204）或 game_id 沒有 unique 約束（42P10）時 PostgREST 回的錯誤碼
+_LEGACY_SCHEMA_ERRORS = frozenset({"42703", "PGRST204", "42P10"})
+
+
+@st.cache_resource(show_spinner=False)
+def _schema_compat() -> Dict[str, bool]:
+    """
+    game_states 是否為舊表（每次存檔 insert 一列、只有 created_at、game_id 沒有 unique）。
+    新寫法（updated_at 排序 / upsert）回傳上面的錯誤碼時設為 True，之後本 process 直接走舊寫法；
+    執行 supabase_schema.sql 升級後重新啟動 App 即可改回新寫法。
+    """
+    return {"legacy": False}
+
+
+def _is_legacy_schema_error(e: Exception) -> bool:
+    return str(getattr(e, "code", "") or "") in _LEGACY_SCHEMA_ERRORS
+
+
+def _latest_state_row(
+    sb: "Client", game_id: str, columns: str, compat: Optional[Dict[str, bool]] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    這一局最新的 game_states 列（新表每局只有一列；舊表取 created_at 最新的一列）。
+    compat 預設為 _schema_compat()；背景執行緒沒有 ScriptRunContext，要由呼叫端傳入。
+    """
+
+    def query(order_col: str) -> Optional[Dict[str, Any]]:
         res = (
             sb.table(SUPABASE_TABLE)
-            .select("state, created_at")
+            .select(columns)
             .eq("game_id", game_id)
-            .order("created_at", desc=True)
+            .order(order_col, desc=True)
             .limit(1)
             .execute()
         )
-        rows = getattr(res, "data", None)
-        if not rows:
+        rows = getattr(res, "data", None) or []
+        return rows[0] if rows else None
+
+    if compat is None:
+        compat = _schema_compat()
+    if not compat["legacy"]:
+        try:
+            return query("updated_at")
+        except Exception as e:
+            if not _is_legacy_schema_error(e):
+                raise
+            compat["legacy"] = True
+    return query("created_at")
+
+
+def supabase_load_latest(game_id: str) -> Tuple[bool, str, Optional[Dict[str, Any]]]:
+    """Load latest state from Supabase for this game_id."""
+    sb = _get_supabase_client()
+    if sb is None:
+        return local_load_latest(game_id)
+
+    try:
+        row = _latest_state_row(sb, game_id, "state")
+        if row is None:
             return True, "雲端沒有找到資料（這是新局）", None
 
-        row = rows[0]
         state = row.get("state")
-        if isinstance(state, str):
-            data = json.loads(state)
-        else:
-            data = state
+        data = _json_loads(state) if isinstance(state, (str, bytes)) else state
         if not isinstance(data, dict):
             return False, "雲端資料格式錯誤", None
+        _load_event_deltas(sb, game_id, data)
         return True, "已從雲端載入最新狀態", data
 
     except Exception as e:
         return False, f"讀取 Supabase 失敗：{type(e).__name__}", None
 
 
-def supabase_save(game_id: str) -> Tuple[bool, str]:
-    """Save current snapshot into Supabase (insert a new row each time)."""
-    sb = st.session_state.get("sb_client")
-    payload = snapshot_state()
+def supabase_remote_version(game_id: str) -> Optional[Tuple[str, Optional[int]]]:
+    """
+    雲端目前版本 (snapshot_id, 最後一筆補寫事件的 seq 或 None)；只查兩個小欄位，不下載整份快照。
+    查不到 / 失敗回傳 None（呼叫端就照常完整載入）。
+    """
+    sb = _get_supabase_client()
     if sb is None:
-        return local_save_state(game_id, payload)
-
+        return None
     try:
-        _ = (
-            sb.table(SUPABASE_TABLE)
-            .insert({"game_id": game_id, "state": payload})
+        row = _latest_state_row(sb, game_id, "snapshot_id:state->>snapshot_id")
+        if not row or not row.get("snapshot_id"):
+            return None
+        snapshot_id = str(row["snapshot_id"])
+        res = (
+            sb.table(SUPABASE_EVENTS_TABLE)
+            .select("seq")
+            .eq("game_id", game_id)
+            .eq("base", snapshot_id)
+            .order("seq", desc=True)
+            .limit(1)
             .execute()
         )
+        rows = getattr(res, "data", None) or []
+        return snapshot_id, (int(rows[0]["seq"]) if rows else None)
+    except Exception:
+        return None
+
+
+def _local_version(game_id: str) -> Optional[Tuple[str, Optional[int]]]:
+    """本機最後一次載入 / 存檔對應的雲端版本（格式同 supabase_remote_version）；有未存或寫入中的變更時回傳 None。"""
+    _sync_save_results(str(game_id))
+    persisted = st.session_state.get("_persist") or {}
+    if (
+        persisted.get("gid") != str(game_id)
+        or not persisted.get("snapshot_id")
+        or unsaved_changes() > 0
+        or st.session_state.get("_persist_pending")
+    ):
+        return None
+    total = len(persisted.get("events") or [])
+    base_len = int(persisted.get("base_len", total))
+    return persisted["snapshot_id"], (total - 1 if total > base_len else None)
+
+
+def _do_supabase_upsert(
+    sb: Optional["Client"], game_id: str, payload: Dict[str, Any], compat: Dict[str, bool]
+) -> Tuple[bool, str]:
+    """
+    Upsert the single snapshot row of this game (or local file when Supabase is unavailable).
+    compat 為 _schema_compat()（背景執行緒沒有 ScriptRunContext，由呼叫端傳入）；舊表改為 insert 一列。
+    """
+    if sb is None:
+        return local_save_state(game_id, payload)
+
+    if not compat["legacy"]:
+        try:
+            _ = (
+                sb.table(SUPABASE_TABLE)
+                .upsert(
+                    {"game_id": game_id, "state": payload, "updated_at": payload.get("saved_at")},
+                    on_conflict="game_id",
+                )
+                .execute()
+            )
+            return True, "已存到雲端"
+        except Exception as e:
+            if not _is_legacy_schema_error(e):
+                return False, f"寫入 Supabase 失敗：{type(e).__name__}"
+            compat["legacy"] = True
+
+    try:
+        _ = sb.table(SUPABASE_TABLE).insert({"game_id": game_id, "state": payload}).execute()
         return True, "已存到雲端"
     except Exception as e:
         return False, f"寫入 Supabase 失敗：{type(e).__name__}"
 
 
-# --- ✅ Recent games quick switch (Supabase last 10) ---
-def supabase_list_recent_game_ids(limit: int = 10, scan_rows: int = 200) -> List[Tuple[str, str]]:
-    """Return recent distinct game_ids with latest created_at (client-side dedupe)."""
-    sb = st.session_state.get("sb_client")
-    if sb is None:
-        return local_list_recent(limit=limit)
+def _snapshot_is_latest(sb: "Client", game_id: str, snapshot_id: str, compat: Dict[str, bool]) -> bool:
+    row = _latest_state_row(sb, game_id, "snapshot_id:state->>snapshot_id", compat)
+    return bool(row) and row.get("snapshot_id") == snapshot_id
+
 
+def _do_supabase_append_events(
+    sb: "Client", game_id: str, delta: Dict[str, Any], compat: Dict[str, bool]
+) -> Tuple[bool, str]:
+    """
+    Append only the new events (one batched insert) after an existing snapshot.
+    雲端最新快照已不是 delta["base"]（其他 session 存了新快照）時，補寫的事件載入時不會被接回：
+    寫入前後都確認 base 仍是最新快照，不是就回報失敗，讓前景改寫完整快照（以最後寫入者為準）。
+    """
+    base = delta["base"]
     try:
-        res = (
-            sb.table(SUPABASE_TABLE)
-            .select("game_id, created_at")
-            .order("created_at", desc=True)
-            .limit(int(scan_rows))
-            .execute()
-        )
-        rows = getattr(res, "data", None) or []
-        seen = set()
-        out: List[Tuple[str, str]] = []
-        for r in rows:
-            gid = r.get("game_id")
-            ts = r.get("created_at")
-            if not gid or gid in seen:
+        if not _snapshot_is_latest(sb, game_id, base, compat):
+            return False, "雲端已有較新的快照，改寫完整快照"
+        start = int(delta["start"])
+        rows = [
+            {"game_id": game_id, "base": base, "seq": start + i, "payload": ev}
+            for i, ev in enumerate(delta["events"])
+        ]
+        _ = sb.table(SUPABASE_EVENTS_TABLE).insert(rows).execute()
+        if not _snapshot_is_latest(sb, game_id, base, compat):
+            return False, "補寫期間雲端快照已更新，改寫完整快照"
+        return True, f"已補寫 {len(rows)} 筆事件到雲端"
+    except Exception as e:
+        return False, f"補寫事件失敗：{type(e).__name__}"
+
+
+# 存檔佇列的項目：(種類, owner, 內容, client, 序號)；序號由 ctl["serial"] 發出，越新越大。
+# owner = (gid, 瀏覽器 session id)：同一局可能同時在兩個 session 開著，各自的請求 / 結果分開記，互不覆蓋。
+# 種類 "flush" 的內容是 threading.Event：背景執行緒立刻寫入手上的請求，寫完後 set。
+SaveOwner = Tuple[str, str]
+SaveOp = Tuple[str, SaveOwner, Any, Any, int]
+
+
+def _save_owner(game_id: str) -> SaveOwner:
+    """本 session 對這個 gid 的存檔 owner key。"""
+    sid = st.session_state.get("_save_sid")
+    if sid is None:
+        sid = st.session_state["_save_sid"] = uuid.uuid4().hex
+    return str(game_id), sid
+
+
+def _save_worker(
+    q: "queue.Queue[SaveOp]", status: Dict[SaveOwner, Tuple[bool, str, int]], ctl: Dict[str, Any]
+) -> None:
+    """
+    背景存檔執行緒：取出佇列中的存檔請求並合併，
+    等到 SAVE_DEBOUNCE_SECONDS 內沒有新請求（或已累積 SAVE_MAX_DELAY_SECONDS）才寫入：
+    同一 owner 的完整快照只寫最新一份，事件補寫合併成一次 insert。
+    序號不大於 ctl["written"][owner] 的請求直接丟掉（同一 session 已寫入更新的版本，例如「立即存檔」）；
+    其他 session 的寫入不影響本 session 的請求（最後寫入的快照為準）。
+    寫入結果記在 status[owner] = (成功?, 訊息, 序號)；失敗後的事件補寫一律略過（也記為失敗），直到完整快照寫入成功。
+    """
+    while True:
+        ops = [q.get()]
+        flushing = ops[0][0] == "flush"
+        deadline = time.monotonic() + SAVE_MAX_DELAY_SECONDS
+        while not flushing:
+            wait = min(SAVE_DEBOUNCE_SECONDS, deadline - time.monotonic())
+            if wait <= 0:
+                break
+            try:
+                ops.append(q.get(timeout=wait))
+            except queue.Empty:
+                break
+            flushing = ops[-1][0] == "flush"
+
+        flush_done: List[threading.Event] = []
+        pending: Dict[SaveOwner, List[Tuple[str, Any, Any, int]]] = {}
+        for kind, owner, body, sb, serial in ops:
+            if kind == "flush":
+                flush_done.append(body)
+                continue
+            todo = pending.setdefault(owner, [])
+            if kind == "snapshot":
+                todo[:] = [(kind, body, sb, serial)]  # 新快照已包含之前所有內容
                 continue
-            seen.add(gid)
-            out.append((str(gid), str(ts) if ts else ""))
-            if len(out) >= int(limit):
+            if todo and todo[-1][0] == "events":
+                prev = todo[-1][1]
+                if prev["base"] == body["base"] and prev["start"] + len(prev["events"]) == body["start"]:
+                    todo[-1] = ("events", dict(prev, events=prev["events"] + body["events"]), sb, serial)
+                    continue
+            todo.append((kind, body, sb, serial))
+
+        written: Dict[SaveOwner, int] = ctl["written"]
+        broken: set = ctl["broken"]
+        with ctl["lock"]:
+            for owner, todo in pending.items():
+                gid = owner[0]
+                for kind, body, sb, serial in todo:
+                    if serial <= written.get(owner, 0):
+                        continue  # 本 session 排隊期間已同步寫入更新的版本，舊內容不能蓋過去
+                    if kind == "events" and owner in broken:
+                        # 之前的寫入失敗，雲端少了事件：補寫接不上，記為失敗讓前景改寫完整快照
+                        status[owner] = (False, "前一次寫入失敗，等待完整快照", serial)
+                        continue
+                    try:
+                        if kind == "snapshot":
+                            ok, msg = _do_supabase_upsert(sb, gid, body, ctl["compat"])
+                        else:
+                            ok, msg = _do_supabase_append_events(sb, gid, body, ctl["compat"])
+                    except Exception as e:
+                        ok, msg = False, f"背景存檔失敗：{type(e).__name__}"
+                    status[owner] = (ok, msg, serial)
+                    if not ok:
+                        broken.add(owner)
+                        continue  # 後續的事件補寫會因 broken 略過並記為失敗
+                    written[owner] = serial
+                    if kind == "snapshot":
+                        broken.discard(owner)
+                ctl["done"][owner] = max(serial for *_, serial in todo)
+        for done in flush_done:
+            done.set()
+
+
+@st.cache_resource(show_spinner=False)
+def _get_save_queue() -> Tuple["queue.Queue[SaveOp]", Dict[SaveOwner, Tuple[bool, str, int]], Dict[str, Any]]:
+    """
+    Process-wide save queue + worker thread (created once, survives reruns).
+    ctl：lock（寫入雲端時持有）、serial（序號產生器）、queued / done / written（每個 owner 最後排入 / 處理完 / 成功寫入的序號）、
+    broken（寫入失敗、等完整快照的 owner）、compat（_schema_compat，給背景執行緒用）。
+    """
+    q: "queue.Queue[SaveOp]" = queue.Queue()
+    status: Dict[SaveOwner, Tuple[bool, str, int]] = {}
+    ctl: Dict[str, Any] = {
+        "lock": threading.Lock(),
+        "serial": itertools.count(1),
+        "queued": {},
+        "done": {},
+        "written": {},
+        "broken": set(),
+        "compat": _schema_compat(),
+    }
+    threading.Thread(target=_save_worker, args=(q, status, ctl), daemon=True, name="mj-save-worker").start()
+    return q, status, ctl
+
+
+def _flush_saves(game_id: str, timeout: float = SAVE_FLUSH_TIMEOUT_SECONDS) -> bool:
+    """
+    讓背景執行緒立刻寫入本 session 對這個 gid 排隊中的存檔並等它寫完（不等 debounce）。
+    沒有排隊中的請求時直接回傳；逾時回傳 False。
+    """
+    owner = _save_owner(game_id)
+    try:
+        q, _, ctl = _get_save_queue()
+    except Exception:
+        return True
+    if ctl["queued"].get(owner, 0) <= ctl["done"].get(owner, 0):
+        return True
+    done = threading.Event()
+    q.put(("flush", owner, done, None, 0))
+    return done.wait(timeout)
+
+
+def supabase_save(game_id: str) -> Tuple[bool, str]:
+    """
+    Queue a background save; returns immediately so st.rerun() is not blocked.
+    只新增事件時只補寫新事件 (O(1))；其他變動、每 SNAPSHOT_EVERY_EVENTS 筆、或上次失敗時寫完整快照。
+    """
+    gid = str(game_id)
+    sb = _get_supabase_client()
+    _sync_save_results(gid)
+    events = st.session_state.get("events", [])
+    pending: List[Tuple[int, Dict[str, Any]]] = st.session_state.setdefault("_persist_pending", [])
+    # 增量以「已排入」的最後狀態為準（還在排隊的事件不重送）；確定寫入成功前不動 _persist
+    persisted = pending[-1][1] if pending else (st.session_state.get("_persist") or {})
+    saved = persisted.get("events") or []
+    last = last_save_status(gid)
+
+    append_only = (
+        sb is not None
+        and persisted.get("gid") == gid
+        and persisted.get("snapshot_id")
+        and (last is None or last[0])
+        and len(saved) <= len(events)
+        and events[: len(saved)] == saved
+        and len(events) - int(persisted.get("base_len", 0)) < SNAPSHOT_EVERY_EVENTS
+        and persisted.get("meta") == _snapshot_meta_key()
+    )
+
+    try:
+        q, _, ctl = _get_save_queue()
+        owner = _save_owner(gid)
+        if append_only:
+            if len(events) == len(saved):
+                return True, "沒有新變更"
+            delta = {"base": persisted["snapshot_id"], "start": len(saved), "events": list(events[len(saved):])}
+            serial = next(ctl["serial"])
+            ctl["queued"][owner] = serial
+            q.put(("events", owner, delta, sb, serial))
+            # 雲端已不只有快照本身，digest 清掉
+            pending.append((serial, dict(persisted, events=list(events), digest=None)))
+        else:
+            payload = snapshot_state()
+            digest = _payload_digest(payload)
+            if persisted.get("gid") == gid and persisted.get("digest") == digest and (last is None or last[0]):
+                return True, "內容未變更，略過存檔"
+            serial = next(ctl["serial"])
+            ctl["queued"][owner] = serial
+            q.put(("snapshot", owner, payload, sb, serial))
+            pending.append((serial, _persist_shadow(gid, payload["snapshot_id"], digest=digest)))
+        return True, "已排入存檔"
+    except Exception as e:
+        return False, f"排入存檔失敗：{type(e).__name__}"
+
+
+def supabase_save_now(game_id: str) -> Tuple[bool, str]:
+    """
+    Save a full snapshot synchronously (for the explicit「立即存檔」button).
+    先讓本 session 排隊中的背景存檔寫完，再在寫入鎖內寫這份快照，並記下序號：
+    本 session 之後才輪到的舊請求會被丟掉，不會蓋掉它（其他 session 的請求照常寫入）。
+    """
+    gid = str(game_id)
+    owner = _save_owner(gid)
+    _flush_saves(gid)
+    _, status, ctl = _get_save_queue()
+    payload = snapshot_state()
+    with ctl["lock"]:
+        serial = next(ctl["serial"])
+        ok, msg = _do_supabase_upsert(_get_supabase_client(), gid, payload, ctl["compat"])
+        status[owner] = (ok, msg, serial)
+        if ok:
+            ctl["written"][owner] = serial
+            ctl["broken"].discard(owner)
+    if ok:
+        _mark_persisted(game_id, payload["snapshot_id"], digest=_payload_digest(payload))
+        _mark_clean()
+    return ok, msg
+
+
+def last_save_status(game_id: str) -> Optional[Tuple[bool, str]]:
+    """Result of this session's most recent save for this gid (None = not saved yet)."""
+    try:
+        _, status, _ = _get_save_queue()
+        res = status.get(_save_owner(game_id))
+        return None if res is None else (res[0], res[1])
+    except Exception:
+        return None
+
+
+def _sync_save_results(gid: str) -> None:
+    """
+    依背景存檔的結果更新本 session 的存檔紀錄（只看本 session 自己的寫入結果）：
+    成功 → 已寫入的排隊項目轉成 _persist；失敗 → 排隊項目作廢並標記未存，下次 flush 改寫完整快照重試。
+    """
+    pending = st.session_state.get("_persist_pending")
+    if not pending:
+        return
+    try:
+        _, status, _ = _get_save_queue()
+    except Exception:
+        return
+    res = status.get(_save_owner(gid))
+    if res is None or res[2] < pending[0][0]:
+        return  # 背景執行緒還沒處理到本 session 排入的項目
+    ok, _, serial = res
+    if not ok:
+        pending.clear()
+        mark_dirty()
+        return
+    confirmed = None
+    while pending and pending[0][0] <= serial:
+        confirmed = pending.pop(0)[1]
+    if confirmed is not None and confirmed.get("gid") == gid:
+        st.session_state["_persist"] = confirmed
+
+
+def mark_dirty() -> None:
+    """標記狀態有變更；實際存檔延到本輪 rerun 結尾由 _maybe_flush() 統一處理一次。"""
+    st.session_state["_dirty_version"] = st.session_state.get("_dirty_version", 0) + 1
+    if st.session_state.get("dirty_since") is None:
+        st.session_state["dirty_since"] = time.monotonic()
+
+
+def _mark_clean() -> None:
+    st.session_state["_flushed_version"] = st.session_state.get("_dirty_version", 0)
+    st.session_state["dirty_since"] = None
+
+
+def unsaved_changes() -> int:
+    """上次排入存檔後又累積了幾次變更。"""
+    return st.session_state.get("_dirty_version", 0) - st.session_state.get("_flushed_version", 0)
+
+
+def _maybe_flush() -> None:
+    """有未存變更（或背景存檔失敗要重試）就排入一次背景存檔（網路寫入再由背景執行緒 debounce）。"""
+    _sync_save_results(str(st.session_state.game_id))
+    if unsaved_changes() <= 0:
+        return
+    ok, _ = supabase_save(st.session_state.game_id)
+    if ok:
+        _mark_clean()
+
+
+# --- ✅ Recent games quick switch (Supabase last 10) ---
+RECENT_GAMES_TTL_SECONDS = 30  # 側欄「近期牌局」清單的快取時間；每次 rerun 不必再打一次 PostgREST
+
+
+@st.cache_data(ttl=RECENT_GAMES_TTL_SECONDS, show_spinner=False)
+def _fetch_recent_game_ids(limit: int) -> List[Tuple[str, str]]:
+    """game_states 每局只有一列，直接由伺服器排序 + limit；舊表同一局有多列，多抓一些在本機去重。"""
+    sb = _get_supabase_client()
+    compat = _schema_compat()
+    if not compat["legacy"]:
+        try:
+            res = (
+                sb.table(SUPABASE_TABLE)
+                .select("game_id, updated_at")
+                .order("updated_at", desc=True)
+                .limit(limit)
+                .execute()
+            )
+            rows = getattr(res, "data", None) or []
+            return [(str(r["game_id"]), str(r.get("updated_at") or "")) for r in rows if r.get("game_id")]
+        except Exception as e:
+            if not _is_legacy_schema_error(e):
+                raise
+            compat["legacy"] = True
+
+    res = (
+        sb.table(SUPABASE_TABLE)
+        .select("game_id, created_at")
+        .order("created_at", desc=True)
+        .limit(limit * 20)
+        .execute()
+    )
+    out: Dict[str, str] = {}
+    for r in getattr(res, "data", None) or []:
+        gid = r.get("game_id")
+        if gid and str(gid) not in out:
+            out[str(gid)] = str(r.get("created_at") or "")
+            if len(out) >= limit:
                 break
-        return out
+    return list(out.items())
+
+
+def supabase_list_recent_game_ids(limit: int = 10) -> List[Tuple[str, str]]:
+    """Return recent game_ids with latest updated_at (cached for RECENT_GAMES_TTL_SECONDS)."""
+    if _get_supabase_client() is None:
+        return local_list_recent(limit=limit)
+
+    try:
+        return _fetch_recent_game_ids(int(limit))
     except Exception:
-        return []
+        return []  # 失敗不進快取，下次 rerun 會重試
 
 
 def switch_to_game_id(gid: str) -> None:
     """Switch current session to another gid by updating query params and forcing cloud reload."""
     gid = str(gid)
+    if gid == st.session_state.get("game_id"):
+        return  # 已經是這一局：不必重新載入
+    _maybe_flush()  # 先把舊 gid 尚未存的變更送出
     try:
         st.query_params["gid"] = gid
     except Exception:
@@ -331,15 +944,13 @@ def set_mobile_layout(enabled: bool) -> None:
     Toggle ?mobile=1 in URL for stable layout.
     This is more reliable than JS auto-detect on iPhone Safari.
     """
+    if _is_mobile_layout() == bool(enabled):
+        return
     try:
         if enabled:
             st.query_params["mobile"] = "1"
         else:
-            qp = dict(st.query_params)
-            qp.pop("mobile", None)
-            st.query_params.clear()
-            for k, v in qp.items():
-                st.query_params[k] = v
+            del st.query_params["mobile"]  # 只移除這個 key，其他參數（gid）不動
     except Exception:
         pass
     st.rerun()
@@ -348,41 +959,44 @@ def set_mobile_layout(enabled: bool) -> None:
 # ============================
 # 3) State / Helpers
 # ============================
-def init_state():
-    st.session_state.setdefault("settings", Settings())
-    st.session_state.setdefault("events", [])       # 當前牌局
-    st.session_state.setdefault("sessions", [])     # 封存的牌局（同一個 game_id 下）
-
-    st.session_state.setdefault("selected_seat", None)
-    st.session_state.setdefault("selected_pid", None)
-    st.session_state.setdefault("seat_locked", False)  # 與 hand_active 同步
-    st.session_state.setdefault("hand_active", False)  # 本將是否開始
-    st.session_state.setdefault("hand_started_at", None)  # 可選：開始本將時間
-    _players = st.session_state.get("settings", Settings()).players
-    st.session_state.setdefault("debug", True)
-
+# session_state 預設值（值為 factory，只在缺少該 key 時才呼叫；game_id 放最後）
+_SESSION_DEFAULTS: Dict[str, Any] = {
+    "settings": Settings,
+    "events": list,  # 當前牌局
+    "sessions": list,  # 封存的牌局（同一個 game_id 下）
+    "selected_seat": lambda: None,
+    "selected_pid": lambda: None,
+    "seat_locked": lambda: False,  # 與 hand_active 同步
+    "hand_active": lambda: False,  # 本將是否開始
+    "hand_started_at": lambda: None,  # 可選：開始本將時間
+    "debug": lambda: True,
     # UI state (reactive widgets keys)
-    st.session_state.setdefault("hand_res", "自摸")
-    st.session_state.setdefault("record_hand_tai", 0)
-    st.session_state.setdefault("hand_win", 0)
-    st.session_state.setdefault("hand_lose", 0)
-
-    st.session_state.setdefault("pen_pt", "詐胡")
-    st.session_state.setdefault("pen_off", 0)
-    st.session_state.setdefault("pen_vic", 0)
-    st.session_state.setdefault("pen_amt", 300)
-
+    "hand_res": lambda: "自摸",
+    "record_hand_tai": lambda: 0,
+    "hand_win": lambda: 0,
+    "hand_lose": lambda: 0,
+    "pen_pt": lambda: "詐胡",
+    "pen_off": lambda: 0,
+    "pen_vic": lambda: 0,
+    "pen_amt": lambda: 300,
     # reset flags
-    st.session_state.setdefault("reset_hand_inputs", False)
-    st.session_state.setdefault("reset_pen_inputs", False)
-
+    "reset_hand_inputs": lambda: False,
+    "reset_pen_inputs": lambda: False,
     # Supabase init
-    st.session_state.setdefault("game_id", _get_or_init_game_id())
-    st.session_state.setdefault("sb_client", _get_supabase_client())
-    st.session_state.setdefault("cloud_loaded", False)
+    "game_id": lambda: _get_or_init_game_id(),
+    "cloud_loaded": lambda: False,
+}
+
+
+def init_state():
+    present = set(st.session_state.keys())
+    for k, factory in _SESSION_DEFAULTS.items():
+        if k not in present:
+            st.session_state[k] = factory()
 
     # Load once
     if not st.session_state.cloud_loaded:
+        _flush_saves(st.session_state.game_id)  # 切回剛離開的 gid 時，先等它排隊中的存檔寫完
         ok, msg, data = supabase_load_latest(st.session_state.game_id)
         st.session_state["cloud_load_msg"] = msg
         if ok and data:
@@ -390,6 +1004,172 @@ def init_state():
         st.session_state.cloud_loaded = True
 
 
+# --- 事件列表的增量指紋（供快取 key 使用，每次 rerun 只讀取，不重新雜湊整個列表） ---
+_FNV64_OFFSET = 0xCBF29CE484222325
+_FNV64_PRIME = 0x100000001B3
+_FNV64_MASK = 0xFFFFFFFFFFFFFFFF
+
+
+def _fnv1a_64(data: bytes) -> int:
+    h = _FNV64_OFFSET
+    for b in data:
+        h = ((h ^ b) * _FNV64_PRIME) & _FNV64_MASK
+    return h
+
+
+def _event_fp_term(seq: int, ev: Any) -> int:
+    return _fnv1a_64(b"%d:" % seq + _json_dumps(ev, sort_keys=True))
+
+
+def _recompute_events_fp() -> None:
+    """整個重算一次（載入 / 被外部整批替換時）。"""
+    fp = 0
+    events = st.session_state.get("events", [])
+    for seq, ev in enumerate(events):
+        fp ^= _event_fp_term(seq, ev)
+    st.session_state["_events_fp"] = fp
+    st.session_state["_events_seq"] = len(events)
+
+
+def events_fingerprint() -> Tuple[int, int]:
+    """(事件數, 指紋)；事件列表內容相同時保證相同。"""
+    if st.session_state.get("_events_seq") != len(st.session_state.get("events", [])):
+        _recompute_events_fp()
+    return st.session_state["_events_seq"], st.session_state["_events_fp"]
+
+
+def append_event(ev: Union[Dict[str, Any], HandEvent, PenaltyEvent]) -> None:
+    """
+    新增一筆事件；一律在這裡轉成標準 dict 再存（HandEvent / PenaltyEvent 投影，已是標準 dict 則原樣）。
+    session 裡的 events 因此永遠是正規化過的，引擎 / 快照每次 rerun 都不必再整列轉換。
+    """
+    ev = ev_to_dict(ev)
+    events = st.session_state.events
+    seq = len(events)
+    events.append(ev)
+    if st.session_state.get("_events_seq") == seq:
+        st.session_state["_events_fp"] ^= _event_fp_term(seq, ev)
+        st.session_state["_events_seq"] = seq + 1
+    else:
+        _recompute_events_fp()
+
+
+def pop_event() -> Optional[Dict[str, Any]]:
+    events = st.session_state.events
+    if not events:
+        return None
+    ev = events.pop()
+    seq = len(events)
+    if st.session_state.get("_events_seq") == seq + 1:
+        # XOR 可逆：移除最後一筆只要再 XOR 一次同一個 term
+        old_fp = st.session_state["_events_fp"]
+        term = _event_fp_term(seq, ev)
+        st.session_state["_events_fp"] = old_fp ^ term
+        st.session_state["_events_seq"] = seq
+        _rewind_game_acc(seq, old_fp, term)
+    else:
+        _recompute_events_fp()
+    return ev
+
+
+def _rewind_game_acc(seq: int, old_fp: int, term: int) -> None:
+    """撤銷最後一筆：累計狀態剛好處理到被移除的那一筆時，直接退回一筆，不必從頭重算整將。"""
+    cached = st.session_state.get("_game_acc")
+    if cached is None:
+        return
+    key, count, prefix_fp, acc = cached
+    if count != seq + 1 or prefix_fp != old_fp:
+        return  # 累計狀態還沒處理到被撤銷的那筆（不受影響），或本來就已過期
+    if truncate_game_acc(acc, seq):
+        st.session_state["_game_acc"] = (key, seq, old_fp ^ term, acc)
+    else:
+        st.session_state.pop("_game_acc", None)
+
+
+def clear_events() -> None:
+    events = st.session_state.get("events")
+    if isinstance(events, list):
+        events.clear()  # 就地清空：各處拿到的都是同一個 list（存檔 / 封存用的都已另外複製）
+    else:
+        st.session_state.events = []
+    st.session_state["_events_fp"] = 0
+    st.session_state["_events_seq"] = 0
+    # 舊局的累計狀態 / 計算結果不可能再命中（指紋已歸零），直接釋放
+    for k in ("_game_acc", "_cgs_key", "_cgs_val"):
+        st.session_state.pop(k, None)
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _cached_game_state(
+    state_key: bytes, events_fp: Tuple[int, int], _settings: Settings, _events: List[Any], _acc: Dict[str, Any]
+):
+    """以 (設定 + debug, 事件指紋) 為 key 快取；底線參數不參與雜湊。未命中時只補算 _acc 之後新增的事件。"""
+    advance_game_acc(_settings, _acc, _events)
+    return finalize_game_acc(_settings, _acc)
+
+
+def _game_state_key(s: Settings) -> Tuple[bytes, bool]:
+    """(設定簽章, debug)：debug 關閉時引擎不產生逐筆 debug 文字，兩種結果不能共用。"""
+    ss = st.session_state
+    debug = bool(ss.get("debug", False))
+    if s is ss.get("settings"):
+        # 設定只在 set_settings 換掉，簽章算一次就沿用，不必每次 rerun 都序列化
+        settings_json = ss.get("_settings_sig")
+        if settings_json is None:
+            settings_json = ss["_settings_sig"] = _json_dumps(s, sort_keys=True)
+    else:
+        settings_json = _json_dumps(s, sort_keys=True)
+    return settings_json + (b"|debug" if debug else b""), debug
+
+
+def _game_acc_for(state_key: bytes, debug: bool, events: List[Any]) -> Dict[str, Any]:
+    """
+    取出本 session 的累計狀態；只有「設定相同且已處理的事件仍是目前事件的前綴」才沿用，
+    否則（撤銷、改設定、換局）從頭開始。
+    """
+    cached = st.session_state.get("_game_acc")
+    if cached is not None:
+        key, count, prefix_fp, acc = cached
+        seq, fp = events_fingerprint()
+        if key == state_key and count == acc["count"] and count <= seq:
+            # XOR 指紋可逆：扣掉前綴之後的事件，就得到前綴本身的指紋
+            for i in range(count, seq):
+                fp ^= _event_fp_term(i, events[i])
+            if fp == prefix_fp:
+                return acc
+    return new_game_acc(debug, debug_keep=DEBUG_STEPS_KEEP)
+
+
+def current_game_totals(s: Settings) -> Tuple[List[int], List[int]]:
+    """只要目前總分 / 統計（依 player_id）時用：直接讀累計狀態，不組 DataFrame。"""
+    state_key, debug = _game_state_key(s)
+    events = st.session_state.get("events", [])
+    acc = _game_acc_for(state_key, debug, events)
+    advance_game_acc(s, acc, events)
+    st.session_state["_game_acc"] = (state_key, acc["count"], events_fingerprint()[1], acc)
+    return acc["cum"], acc["stats"]
+
+
+def current_game_state(s: Settings):
+    """
+    目前這一將的 compute_game_state 結果；事件與設定都沒變時直接取快取，新增事件時只算新增的部分。
+    回傳的 DataFrame 會跨 rerun 共用，呼叫端只讀不改。
+    """
+    state_key, debug = _game_state_key(s)
+    key = (state_key, events_fingerprint())
+    # 同一 session 連續 rerun 且沒變動：直接用上次的結果（st.cache_data 命中仍要反序列化整個 DataFrame）
+    if st.session_state.get("_cgs_key") == key:
+        return st.session_state["_cgs_val"]
+    events = st.session_state.get("events", [])
+    acc = _game_acc_for(state_key, debug, events)
+    result = _cached_game_state(state_key, key[1], s, events, acc)
+    if acc["count"] == len(events):
+        st.session_state["_game_acc"] = (state_key, acc["count"], key[1][1], acc)
+    st.session_state["_cgs_key"] = key
+    st.session_state["_cgs_val"] = result
+    return result
+
+
 def _apply_reset_flags_before_widgets():
     """
     在 UI widget 建立前，根據 reset flags 清掉對應 widget state，
@@ -420,82 +1200,74 @@ def _apply_reset_flags_before_widgets():
         st.session_state["reset_pen_inputs"] = False
 
 
+def player_label_func(players: List[str]) -> Callable[[int], str]:
+    """
+    selectbox 的 format_func：玩家 id → 名稱。每次 render 先把名稱複製成 tuple，
+    回傳它的 __getitem__（C 實作），選項值仍是玩家 id，session_state 裡存的也還是 id。
+    """
+    return tuple(players).__getitem__
+
+
+def _sum_by_player(frames: List[pd.DataFrame], names: List[str], fields: List[str]) -> pd.DataFrame:
+    """多張「玩家 + 數值欄」的表一次 concat + groupby 加總，依 names 排列（沒出現的補 0）。"""
+    if not frames:
+        return pd.DataFrame(0, index=names, columns=fields, dtype="int64")
+    all_rows = pd.concat(frames, ignore_index=True)
+    totals = all_rows[fields].fillna(0).astype("int64").groupby(all_rows["玩家"], sort=False).sum()
+    return totals.reindex(names, fill_value=0)
+
+
+def _archived_sums(table_key: str, fields: List[str], names: List[str]) -> pd.DataFrame:
+    """
+    已封存 sessions 的加總（依玩家）。sessions 只會 append 或整批換掉，
+    所以同一個 list、長度與玩家都沒變時直接沿用上次結果，每次 rerun 只需加上進行中這一將。
+    """
+    sessions = st.session_state.get("sessions", [])
+    memo = st.session_state.setdefault("_archived_sums", {})
+    key = (len(sessions), tuple(names), tuple(fields))
+    hit = memo.get(table_key)
+    if hit is not None and hit[0] is sessions and hit[1] == key:
+        return hit[2]
+    cols = ["玩家"] + fields
+    totals = _sum_by_player([_session_table(sess, table_key, cols) for sess in sessions], names, fields)
+    memo[table_key] = (sessions, key, totals)
+    return totals
+
+
 def compute_daily_total(settings: Settings, cur_sum_df: Optional[pd.DataFrame] = None) -> pd.DataFrame:
     """計算當天累計總分：支持傳入已計算好的當前局分數(cur_sum_df)以優化效能。"""
-    names = settings.players
-    total_scores = {p: 0 for p in names}
-    
-    # 1. 歷史分數 (加總過去已結束的將次)
-    for sess in st.session_state.get("sessions", []):
-        rows = sess.get("sum_df", [])
-        for row in rows:
-            p = row.get("玩家")
-            if p in total_scores:
-                total_scores[p] += int(row.get("總分", 0))
-                
-    # 2. 目前這一將的分數
-    if cur_sum_df is not None:
-        # ✅ 優化點：直接使用外部傳進來的結果
-        for _, row in cur_sum_df.iterrows():
-            p = row.get("玩家")
-            if p in total_scores:
-                total_scores[p] += int(row.get("總分", 0))
-    else:
+    names = list(dict.fromkeys(settings.players))
+
+    # 1. 歷史分數 (過去已結束的將次，快取) + 2. 目前這一將的分數
+    totals = _archived_sums("sum_df", ["總分"], names)["總分"]
+    if cur_sum_df is None:
         # 降級方案：如果沒傳，才現場算
-        current_events = st.session_state.get("events", [])
-        if current_events:
-            _, tmp_sum, _, _, _, _, _, _ = compute_game_state(settings, current_events)
-            for _, row in tmp_sum.iterrows():
-                p = row.get("玩家")
-                if p in total_scores:
-                    total_scores[p] += int(row.get("總分", 0))
+        if st.session_state.get("events"):
+            cum, _ = current_game_totals(settings)
+            cur_sum_df = pd.DataFrame({"玩家": settings.players, "總分": cum})
+    if cur_sum_df is not None:
+        totals = totals + _sum_by_player([cur_sum_df[["玩家", "總分"]]], names, ["總分"])["總分"]
 
-    return pd.DataFrame([{"玩家": k, "總分": v} for k, v in total_scores.items()])
+    return pd.DataFrame({"玩家": names, "總分": totals.to_numpy()})
 
 # ✅ 1. 增加 Optional[pd.DataFrame] 參數，讓它能接收算好的結果
 def compute_daily_stats(settings: Settings, cur_stats_df: Optional[pd.DataFrame] = None) -> pd.DataFrame:
     """計算當天累計統計：支持傳入已計算好的當前局統計(cur_stats_df)以優化效能。"""
-    names = settings.players
+    names = list(dict.fromkeys(settings.players))  # 與 compute_daily_total 相同的玩家列
     stats_fields = ["自摸", "胡", "放槍", "詐胡", "詐摸"]
-    daily_stats = {p: {f: 0 for f in stats_fields} for p in names}
-
-    # 1. 加上過去已封存 sessions 的統計 (不變)
-    for sess in st.session_state.get("sessions", []):
-        hist_stats = sess.get("stats_df", [])
-        rows = hist_stats.to_dict('records') if isinstance(hist_stats, pd.DataFrame) else hist_stats
-        for row in rows:
-            p = row.get("玩家")
-            if p in daily_stats:
-                for f in stats_fields:
-                    daily_stats[p][f] += int(row.get(f, 0))
-
-    # 2. 加上目前進行中的即時統計
+
+    # 1. 過去已封存 sessions 的統計（快取） + 2. 目前進行中的即時統計
+    totals = _archived_sums("stats_df", stats_fields, names)
+    if cur_stats_df is None and st.session_state.get("events"):
+        # 降級方案：沒傳入才從累計狀態取
+        _, cur_stats = current_game_totals(settings)
+        cur_stats_df = pd.DataFrame(stats_matrix(cur_stats), columns=stats_fields)
+        cur_stats_df.insert(0, "玩家", settings.players[:4])
     if cur_stats_df is not None:
-        # ✅ 2. 效能優化：如果外面算好了，直接用傳進來的結果
-        for _, row in cur_stats_df.iterrows():
-            p = row.get("玩家")
-            if p in daily_stats:
-                for f in stats_fields:
-                    daily_stats[p][f] += int(row.get(f, 0))
-    else:
-        # 降級方案：沒傳入才現場重算
-        current_events = st.session_state.get("events", [])
-        if current_events:
-            _, _, tmp_stats, _, _, _, _, _ = compute_game_state(settings, current_events)
-            for _, row in tmp_stats.iterrows():
-                p = row.get("玩家")
-                if p in daily_stats:
-                    for f in stats_fields:
-                        daily_stats[p][f] += int(row.get(f, 0))
-
-    # 3. 整理成 DataFrame 回傳 (不變)
-    output = []
-    for p_name in names:
-        r = {"玩家": p_name}
-        r.update(daily_stats[p_name])
-        output.append(r)
-    
-    return pd.DataFrame(output)
+        totals = totals + _sum_by_player([cur_stats_df.reindex(columns=["玩家"] + stats_fields)], names, stats_fields)
+
+    # 3. 整理成 DataFrame 回傳（欄位陣列直接建表）
+    return pd.DataFrame({"玩家": names, **{f: totals[f].to_numpy() for f in stats_fields}})
 
                     
 # ============================
@@ -522,7 +1294,7 @@ def page_settings(s: Settings):
         st.divider()
         cT1, cT2 = st.columns(2)
         draw_keep = cT1.toggle("流局連莊", value=bool(s.draw_keeps_dealer), key="set_draw_keep")
-        auto_bonus = cT2.toggle("莊家加台自動計算", value=bool(getattr(s, "auto_dealer_bonus", True)), help="開啟後：台數只填牌型台；遇到莊家/連莊相關情境會自動加上莊連台。", key="set_auto_bonus")
+        auto_bonus = cT2.toggle("莊家加台自動計算", value=s.auto_dealer_bonus, help="開啟後：台數只填牌型台；遇到莊家/連莊相關情境會自動加上莊連台。", key="set_auto_bonus")
 
         st.divider()
         st.subheader("東（可選）")
@@ -530,7 +1302,7 @@ def page_settings(s: Settings):
             "場主(東錢收款者)",
             options=[0, 1, 2, 3],
             index=int(s.host_player_id),
-            format_func=lambda pid: new_players[pid],
+            format_func=player_label_func(new_players),
             key="set_host",
         )
         c3, c4 = st.columns(2)
@@ -540,21 +1312,18 @@ def page_settings(s: Settings):
         save = st.form_submit_button("💾 儲存設定", use_container_width=True)
 
     if save:
-        s.players = new_players
-        s.base = int(base)
-        s.tai_value = int(tai_value)
-        s.draw_keeps_dealer = bool(draw_keep)
-        s.auto_dealer_bonus = bool(auto_bonus)
-        s.host_player_id = int(host)
-        s.dong_per_self_draw = int(dong_x)
-        s.dong_cap_total = int(dong_cap)
-
-        st.session_state.settings = s
-        ok, msg = supabase_save(st.session_state.game_id)
-        if ok:
-            st.success("✅ 已儲存設定（雲端已保存）")
-        else:
-            st.warning(f"⚠️ 已儲存設定（但雲端保存失敗：{msg}）")
+        set_settings(replace(
+            s,
+            players=new_players,
+            base=base,
+            tai_value=tai_value,
+            draw_keeps_dealer=draw_keep,
+            auto_dealer_bonus=auto_bonus,
+            host_player_id=host,
+            dong_per_self_draw=dong_x,
+            dong_cap_total=dong_cap,
+        ))
+        mark_dirty()
         st.rerun()
 
 
@@ -566,68 +1335,204 @@ def _build_scores_view(s: Settings, daily_sum_df: Optional[pd.DataFrame] = None)
     # 1. 產生方位對照表 (方位 -> 玩家名)
     seat_map = {WINDS[i]: s.players[s.seat_players[i]] for i in range(4)}
 
-    # 2. 準備當前所有玩家的分數對照表
-    current_scores = {p: 0 for p in s.players}
+    # 2. 玩家名 → 分數的 dict 只建一次（整欄取出，不逐列 iterrows、不逐座位篩 DataFrame）
+    totals: Dict[str, int] = {}
     if daily_sum_df is not None and not daily_sum_df.empty:
-        for _, row in daily_sum_df.iterrows():
-            p_name = row.get("玩家")
-            if p_name in current_scores:
-                current_scores[p_name] = int(row.get("總分", 0))
+        totals = dict(zip(daily_sum_df["玩家"].tolist(), daily_sum_df["總分"].tolist()))
 
     # 3. 依照「東南西北」座位順序提取分數
-    scores_view_by_seat = [
-        current_scores.get(seat_map["東"], 0),
-        current_scores.get(seat_map["南"], 0),
-        current_scores.get(seat_map["西"], 0),
-        current_scores.get(seat_map["北"], 0),
-    ]
+    scores_view_by_seat = [totals.get(s.players[pid], 0) for pid in s.seat_players]
 
     return seat_map, scores_view_by_seat
 
 
+def _on_seat_click(seat_idx: int) -> None:
+    """座位按鈕 on_click：在本次 rerun 開始前就更新選取/換位狀態，不需要再額外 st.rerun()。"""
+    s: Settings = st.session_state.settings
+    seat_locked = bool(st.session_state.get("seat_locked", False))
+
+    if seat_locked:
+        # 僅選取玩家/座位（顯示快速輸入面板），不交換
+        if st.session_state.selected_seat == seat_idx:
+            st.session_state.selected_seat = None
+            st.session_state.selected_pid = None  # 點同一人取消選取
+        else:
+            st.session_state.selected_seat = seat_idx
+            st.session_state.selected_pid = s.seat_players[seat_idx]
+    else:
+        # 交換座位模式
+        if st.session_state.selected_seat is None:
+            st.session_state.selected_seat = seat_idx
+            st.session_state.selected_pid = s.seat_players[seat_idx]
+        else:
+            o = st.session_state.selected_seat
+            seats = list(s.seat_players)
+            seats[o], seats[seat_idx] = seats[seat_idx], seats[o]
+            st.session_state.selected_seat = None
+            st.session_state.selected_pid = None
+            set_settings(replace(s, seat_players=seats))
+            st.session_state["_app_rerun"] = True  # 換位會改變莊家對應，整頁都要重算
+            mark_dirty()
+
+
+def _on_toggle_seat_lock() -> None:
+    if st.session_state.get("hand_active", False):
+        return
+    st.session_state["seat_locked"] = not bool(st.session_state.get("seat_locked", False))
+    st.session_state["selected_seat"] = None
+    mark_dirty()
+
+
+def _on_start_mahjong() -> None:
+    st.session_state["hand_active"] = True
+    st.session_state["seat_locked"] = True
+    st.session_state["hand_started_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    st.session_state["selected_seat"] = None
+    mark_dirty()
+
+
+def _on_quick_submit(pid: int) -> None:
+    """
+    快速輸入「提交」on_click：在 rerun 前寫入事件，座位分數在同一輪就更新，不需要再 st.rerun()。
+    連續輸入模式下保持面板開啟（只把台數歸零），方便一口氣輸入多手。
+    """
+    ss = st.session_state
+    res = ss.get(f"qp_res_{pid}", "自摸")
+    if res in ("詐胡", "詐摸"):
+        vic = ss.get(f"qp_vic_{pid}") if res == "詐胡" else 0
+        if res == "詐胡" and (vic is None or vic == pid):
+            ss["qp_error"] = "詐胡時：賠付對象不能是違規者本人"
+            return
+        append_event(PenaltyEvent(res, offender_id=pid, victim_id=vic, amount=ss.get(f"qp_amt_{pid}", 0)))
+        if not ss.get("quick_continuous", False):
+            ss["selected_seat"] = None
+        ss["reset_pen_inputs"] = True
+        ss["_app_rerun"] = True
+        mark_dirty()
+        return
+    scored = res in ("自摸", "胡牌")
+    win = ss.get(f"qp_win_{pid}", pid) if scored else pid
+    lose = ss.get(f"qp_lose_{pid}") if res == "胡牌" else None
+    if res == "胡牌" and (lose is None or win == lose):
+        ss["qp_error"] = "胡牌時：贏家與輸家不能相同"
+        return
+    append_event(HandEvent(
+        "放槍" if res == "胡牌" else res,
+        winner_id=win if scored else None,
+        loser_id=lose,
+        tai=ss.get(f"qp_tai_{pid}", 0) if scored else 0,
+    ))
+    if ss.get("quick_continuous", False):
+        ss[f"qp_tai_{pid}"] = 0
+    else:
+        ss["selected_seat"] = None
+    ss["reset_hand_inputs"] = True
+    ss["_app_rerun"] = True  # 分數 / 局數 / 流水帳都變了，整頁重跑
+    mark_dirty()
+
+
+def _on_record_submit_hand() -> None:
+    """「一般」提交 on_click：從 widget 的 session_state 讀值寫入事件（與快速輸入相同做法）。"""
+    ss = st.session_state
+    res = ss.get("record_hand_res", "自摸")
+    scored = res in ("自摸", "胡牌")
+    win = ss.get("record_hand_win", 0) if scored else None
+    lose = ss.get("record_hand_lose", 0) if res == "胡牌" else None
+    if res == "胡牌" and win == lose:
+        ss["record_error"] = "胡牌時：贏家與輸家不能相同"
+        return
+    append_event(HandEvent(
+        "放槍" if res == "胡牌" else res,
+        winner_id=win,
+        loser_id=lose,
+        tai=ss.get("record_hand_tai", 0) if scored else 0,
+    ))
+    ss["reset_hand_inputs"] = True
+    mark_dirty()
+
+
+def _on_record_submit_penalty() -> None:
+    ss = st.session_state
+    pt = ss.get("record_pen_pt", "詐胡")
+    append_event(PenaltyEvent(
+        pt,
+        offender_id=ss.get("record_pen_off", 0),
+        victim_id=ss.get("record_pen_vic", 0) if pt == "詐胡" else 0,
+        amount=ss.get("record_pen_amt", 0),
+    ))
+    ss["reset_pen_inputs"] = True
+    mark_dirty()
+
+
+def _on_debug_toggle() -> None:
+    """Debug 開關 on_change：在 rerun 開始前就更新 debug，本輪計算遊戲狀態時才會產生 debug 步驟。"""
+    st.session_state.debug = bool(st.session_state.get("record_debug_toggle", False))
+
+
+def _on_record_undo() -> None:
+    if st.session_state.events:
+        pop_event()
+        mark_dirty()
+
+
+def _on_record_clear_events() -> None:
+    clear_events()
+    st.session_state["reset_hand_inputs"] = True
+    st.session_state["reset_pen_inputs"] = True
+    mark_dirty()
+
+
+def render_ledger_table(ledger_df: pd.DataFrame, key: str):
+    """流水帳：長局預設只送最後 LEDGER_TAIL_ROWS 筆（整張表每次 rerun 都要轉 Arrow 傳給前端）。"""
+    n = len(ledger_df)
+    if n <= LEDGER_TAIL_ROWS:
+        st.dataframe(ledger_df, hide_index=True, use_container_width=True)
+        return
+    # 用 toggle 而不是 expander：expander 收合時內容一樣會送到前端
+    if st.toggle(f"顯示全部（共 {n} 筆）", value=False, key=key):
+        st.dataframe(ledger_df, hide_index=True, use_container_width=True)
+    else:
+        st.caption(f"只顯示最近 {LEDGER_TAIL_ROWS} 筆")
+        st.dataframe(ledger_df.tail(LEDGER_TAIL_ROWS), hide_index=True, use_container_width=True)
+
+
+def _chart_points(ledger_df: pd.DataFrame) -> pd.DataFrame:
+    """走勢圖點數太多時等距抽樣（保留最後一筆，終點分數不變）。"""
+    n = len(ledger_df)
+    if n <= 2 * CHART_MAX_POINTS:
+        return ledger_df
+    idx = np.arange(0, n, n // CHART_MAX_POINTS)
+    if idx[-1] != n - 1:
+        idx = np.append(idx, n - 1)
+    return ledger_df.iloc[idx]
+
+
+def _seat_labels(s: Settings, dealer_seat: int, scores_view_by_seat: List[int], selected_seat: Optional[int]) -> List[str]:
+    """四個座位按鈕的文字；輸入沒變（只是切換其他 widget 的 rerun）就沿用上次組好的字串。"""
+    key = (tuple(s.seat_players), tuple(s.players), dealer_seat, tuple(scores_view_by_seat), selected_seat)
+    if st.session_state.get("_seatmap_labels_key") == key:
+        return st.session_state["_seatmap_labels"]
+    labels = []
+    for seat_idx in range(4):
+        name = s.players[s.seat_players[seat_idx]]
+        mark = " 🀄" if seat_idx == dealer_seat else ""
+        prefix = "👉 " if selected_seat == seat_idx else ""
+        labels.append(f"{prefix}{WINDS[seat_idx]}：{name}{mark} (${scores_view_by_seat[seat_idx]})")
+    st.session_state["_seatmap_labels_key"] = key
+    st.session_state["_seatmap_labels"] = labels
+    return labels
+
+
 def render_seat_map(s: Settings, sum_df: pd.DataFrame, dealer_seat: int, daily_sum_df: Optional[pd.DataFrame] = None, scores_view_by_seat: Optional[List[int]] = None):
     """sum_df=本將分數，daily_sum_df=當天累計總分。scores_view_by_seat 提供時以「分數跟人走」顯示。"""
-    def seat_btn(seat_idx: int, container):
-        pid = s.seat_players[seat_idx]
-        name = s.players[pid]
-        if scores_view_by_seat is not None:
-            score = scores_view_by_seat[seat_idx]
-        else:
-            display_df = daily_sum_df if daily_sum_df is not None and not daily_sum_df.empty else sum_df
-
-            # ✅ 改用這段安全取值：先檢查長度，避免 IndexError
-            vals = display_df.loc[display_df["玩家"] == name, "總分"].values
-            score = int(vals[0]) if len(vals) > 0 else 0
-        is_dealer = (seat_idx == dealer_seat)
-        mark = " 🀄" if is_dealer else ""
-        prefix = "👉 " if st.session_state.selected_seat == seat_idx else ""
-        label = f"{prefix}{WINDS[seat_idx]}：{name}{mark} (${score})"
-
-        if container.button(label, key=f"record_seatbtn_{seat_idx}", use_container_width=True):
-            seat_locked = bool(st.session_state.get("seat_locked", False))
-
-            if seat_locked:
-                # 僅選取玩家/座位（顯示快速輸入面板），不交換
-                if st.session_state.selected_seat == seat_idx:
-                    st.session_state.selected_seat = None
-                    st.session_state.selected_pid = None  # 點同一人取消選取
-                else:
-                    st.session_state.selected_seat = seat_idx
-                    st.session_state.selected_pid = s.seat_players[seat_idx]
-            else:
-                # 交換座位模式
-                if st.session_state.selected_seat is None:
-                    st.session_state.selected_seat = seat_idx
-                    st.session_state.selected_pid = s.seat_players[seat_idx]
-                else:
-                    o = st.session_state.selected_seat
-                    s.seat_players[o], s.seat_players[seat_idx] = s.seat_players[seat_idx], s.seat_players[o]
-                    st.session_state.selected_seat = None
-                    st.session_state.selected_pid = None
-                    st.session_state.settings = s
-                    supabase_save(st.session_state.game_id)
+    if scores_view_by_seat is None:
+        # 四個座位的分數一次查好（依座位索引），不在每個按鈕裡各篩一次 DataFrame
+        display_df = daily_sum_df if daily_sum_df is not None and not daily_sum_df.empty else sum_df
+        _, scores_view_by_seat = _build_scores_view(s, display_df)
+    labels = _seat_labels(s, dealer_seat, scores_view_by_seat, st.session_state.selected_seat)
 
-            st.rerun()
+    def seat_btn(seat_idx: int, container):
+        container.button(labels[seat_idx], key=f"record_seatbtn_{seat_idx}", use_container_width=True, on_click=_on_seat_click, args=(seat_idx,))
 
     # 📱 Mobile: vertical order 東南西北
     if _is_mobile_layout():
@@ -637,34 +1542,148 @@ def render_seat_map(s: Settings, sum_df: pd.DataFrame, dealer_seat: int, daily_s
         seat_btn(3, st)  # 北
         return
 
-    # 🖥 Desktop: cross layout
-    top = st.columns([1, 1.5, 1])
-    seat_btn(1, top[1])  # 南
-    mid = st.columns([1, 1.5, 1])
-    seat_btn(2, mid[0])  # 西
-    seat_btn(0, mid[2])  # 東
-    bot = st.columns([1, 1.5, 1])
-    seat_btn(3, bot[1])  # 北
+    # 🖥 Desktop: cross layout（一次 st.columns；中欄上下放南北，左右欄垂直置中放西東）
+    left, middle, right = st.columns([1, 1.5, 1], vertical_alignment="center")
+    seat_btn(1, middle)  # 南
+    middle.write("")  # 南北之間留出西東那一列的空間
+    seat_btn(3, middle)  # 北
+    seat_btn(2, left)  # 西
+    seat_btn(0, right)  # 東
+
+
+def _seat_panel_body(
+    s: Settings,
+    sum_df: pd.DataFrame,
+    dealer_seat: int,
+    daily_sum_df: Optional[pd.DataFrame],
+    scores_view_by_seat: List[int],
+    is_game_over: bool,
+):
+    """
+    座位圖 + 快速輸入面板。包成 fragment 後，點座位、切動作、調台數都只重跑這一塊；
+    真正改到分數 / 座位的操作（callback 設 _app_rerun）才整頁重跑。
+    """
+    fmt_player = player_label_func(s.players)
+    render_seat_map(s, sum_df, dealer_seat=dealer_seat, daily_sum_df=daily_sum_df, scores_view_by_seat=scores_view_by_seat)
+
+    # ---------- B: 快速輸入面板（座位區塊下方，固定不往下滑） ----------
+    sel_seat = st.session_state.get("selected_seat")
+    if sel_seat is not None:
+        pid = s.seat_players[sel_seat]
+        st.caption(f"快速輸入（已選 {s.players[pid]}）")
+        # 單一個 radio 選動作（比一排按鈕少很多 widget，也不用每顆按鈕各自記狀態）
+        qp_res = st.radio(
+            "動作", QUICK_ACTIONS, horizontal=True, key=f"qp_res_{pid}", label_visibility="collapsed"
+        )
+
+        # 數值由 _on_quick_submit 從 session_state 讀取
+        if qp_res in ("自摸", "胡牌"):
+            st.number_input("台數", min_value=0, step=1, key=f"qp_tai_{pid}")
+
+        qp_win = pid
+        if qp_res in ("自摸", "胡牌"):
+            qp_win = st.selectbox("贏家", [0, 1, 2, 3], index=pid, format_func=fmt_player, key=f"qp_win_{pid}")
+
+        if qp_res == "胡牌":
+            lose_opts = [p for p in [0, 1, 2, 3] if p != qp_win]
+            st.selectbox("輸家", lose_opts, format_func=fmt_player, key=f"qp_lose_{pid}")
+
+        if qp_res == "詐胡":
+            vic_opts = [p for p in [0, 1, 2, 3] if p != pid]
+            st.selectbox("賠付對象", vic_opts, format_func=fmt_player, key=f"qp_vic_{pid}")
+        if qp_res in ("詐胡", "詐摸"):
+            st.number_input("金額", min_value=0, step=50, key=f"qp_amt_{pid}")
+
+        st.checkbox("連續輸入（提交後保持面板開啟）", key="quick_continuous")
+        st.button(
+            "✅ 提交",
+            use_container_width=True,
+            key=f"qp_submit_{pid}",
+            disabled=is_game_over,
+            on_click=_on_quick_submit,
+            args=(pid,),
+        )
+        qp_error = st.session_state.pop("qp_error", None)
+        if qp_error:
+            st.error(qp_error)
+
+    if st.session_state.pop("_app_rerun", False) and _fragment is not None:
+        st.rerun()
+
+
+_seat_panel = _fragment(_seat_panel_body) if _fragment is not None else _seat_panel_body
+
+
+def _pack_session_events(events: List[Any]) -> str:
+    """封存的事件只留作紀錄：壓成 base64(zlib(JSON)) 字串，快照不再隨事件數線性變大。"""
+    return base64.b64encode(zlib.compress(_json_dumps(normalize_events(events)), 1)).decode("ascii")
+
+
+def _compact_sessions(sessions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """舊存檔的 sessions 仍帶完整 events 列表時，改成壓縮後的 events_z。"""
+    out = []
+    for sess in sessions:
+        if isinstance(sess, dict) and isinstance(sess.get("events"), list):
+            sess = dict(sess)
+            sess["events_z"] = _pack_session_events(sess.pop("events"))
+        out.append(sess)
+    return out
+
+
+def _pack_table(df: pd.DataFrame) -> Dict[str, Any]:
+    """封存用的精簡表格：欄名只存一次 + 逐列值（JSON 比 records 小，也不必每列重建 dict）。"""
+    split = df.to_dict(orient="split")
+    return {"cols": split["columns"], "data": split["data"]}
+
+
+def _session_table(sess: Dict[str, Any], key: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    讀回封存表格；同時支援 _pack_table 格式與舊存檔的 records 格式。
+    封存後的 session 不會再被修改，建好的 DataFrame 依 (session, 表, 欄位) 快取在 session_state，
+    數據總覽每次 rerun 不必重建；回傳的 DataFrame 呼叫端只讀不改。
+    """
+    cache = st.session_state.setdefault("_sess_df_cache", {})
+    ck = (id(sess), key, tuple(columns) if columns is not None else None)
+    hit = cache.get(ck)
+    if hit is not None and hit[0] is sess:
+        return hit[1]
+
+    v = sess.get(key)
+    if isinstance(v, dict) and "cols" in v:
+        df = pd.DataFrame(v.get("data") or [], columns=v["cols"])
+    else:
+        df = pd.DataFrame(v or [])
+    if columns is not None:
+        df = df.reindex(columns=columns)
+
+    sessions = st.session_state.get("sessions", [])
+    if len(cache) > 4 * len(sessions) + 8:
+        # sessions 被整批換掉（載入 / 清空）後，舊 session 的快取就用不到了
+        live = {id(x) for x in sessions}
+        for k in [k for k in cache if k[0] not in live]:
+            del cache[k]
+    cache[ck] = (sess, df)
+    return df
 
 
 def end_current_session(s: Settings):
     """把目前 events 封存到 sessions，然後清空 events 開新局。"""
     events = st.session_state.events
-    ledger_df, sum_df, stats_df, rw, ds, dr, d_acc, _ = compute_game_state(s, events)
+    ledger_df, sum_df, stats_df, rw, ds, dr, d_acc, _ = current_game_state(s)
 
     stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     session = {
         "ended_at": stamp,
         "event_count": len(events),
-        "dong_total": int(d_acc),
-        "events": [ev_to_dict(e) for e in events],  # 供當天累計總分合併計算
-        "sum_df": sum_df.to_dict(orient="records"),
-        "stats_df": stats_df.to_dict(orient="records"),
-        "ledger_tail": ledger_df.tail(20).to_dict(orient="records"),
+        "dong_total": d_acc,
+        "events_z": _pack_session_events(events),  # 當天累計只用 sum_df / stats_df；完整事件壓縮備查
+        "sum_df": _pack_table(sum_df),
+        "stats_df": _pack_table(stats_df),
+        "ledger_tail": _pack_table(ledger_df.tail(20)),
     }
     st.session_state.sessions.append(session)
 
-    st.session_state.events = []
+    clear_events()
     st.session_state["selected_seat"] = None
     st.session_state["seat_locked"] = False
     st.session_state["hand_active"] = False
@@ -672,10 +1691,33 @@ def end_current_session(s: Settings):
     st.session_state["reset_pen_inputs"] = True
     st.session_state["_game_over_warned"] = False
 
-    supabase_save(st.session_state.game_id)
+    mark_dirty()
+
+
+def _reload_from_cloud(gid: str) -> None:
+    """「從雲端重新載入」：先把本機尚未寫到雲端的變更送出並等它寫完，否則載入的雲端狀態會少掉這些事件。"""
+    _maybe_flush()
+    if not _flush_saves(gid):
+        st.error("背景存檔尚未完成，請稍後再重新載入")
+        return
+    local_ver = _local_version(gid)
+    if local_ver is not None and supabase_remote_version(gid) == local_ver:
+        # 先比對版本（兩個小查詢），相同就不必下載整份快照 + 事件
+        st.info("雲端沒有更新，已是最新 ✅")
+        return
+    ok, msg, data = supabase_load_latest(gid)
+    if ok and data:
+        restore_state(data)
+        st.success("已從雲端載入 ✅")
+        st.rerun()
+    elif ok:
+        st.warning("雲端沒有資料（新局）")
+    else:
+        st.error(msg)
 
 
 def _new_game_confirmed():
+    _maybe_flush()  # 先把舊 gid 尚未存的變更送出
     new_gid = uuid.uuid4().hex
     try:
         st.query_params["gid"] = new_gid
@@ -683,8 +1725,8 @@ def _new_game_confirmed():
         pass
 
     st.session_state.game_id = new_gid
-    st.session_state.settings = Settings()
-    st.session_state.events = []
+    set_settings(Settings())
+    clear_events()
     st.session_state.sessions = []
     st.session_state.selected_seat = None
     st.session_state["hand_active"] = False
@@ -693,7 +1735,7 @@ def _new_game_confirmed():
     st.session_state["reset_pen_inputs"] = True
     st.session_state.cloud_loaded = True
     st.session_state["_game_over_warned"] = False
-    supabase_save(st.session_state.game_id)
+    mark_dirty()
     st.rerun()
 
 
@@ -701,36 +1743,37 @@ def page_record(s: Settings):
     st.header("🀄 牌局錄入")
 
     _apply_reset_flags_before_widgets()
+    fmt_player = player_label_func(s.players)
 
-    ledger_df, sum_df, stats_df, rw, ds, dr, d_acc, debug_steps = compute_game_state(s, st.session_state.events)
+    ledger_df, sum_df, stats_df, rw, ds, dr, d_acc, debug_steps = current_game_state(s)
 
     # ✅ 避免 compute_daily_total 內部又重算一次 compute_game_state
     daily_sum_df = compute_daily_total(s, cur_sum_df=sum_df)
 
-    mj_active = bool(st.session_state.get("hand_active", False))
+    # 常用的 session_state 值在進頁時讀一次（每次 .get 都要經過 SessionState proxy）
+    ss = st.session_state
+    events = ss.events  # 撤銷 / 清空都就地修改同一個 list，整頁讀這個區域變數即可
+    mj_active = bool(ss.get("hand_active", False))
 
     # ✅ 全頁共用：本將是否已結束（北四打完）
     is_game_over = (rw >= 4)
 
     # 若本將已結束，強制同步狀態，避免殘留 hand_active / seat_locked
     if is_game_over:
-        st.session_state["hand_active"] = False
-        st.session_state["seat_locked"] = False
+        ss["hand_active"] = False
+        ss["seat_locked"] = False
+    seat_locked = bool(ss.get("seat_locked", False))
+    debug_on = bool(ss.get("debug", False))
 
     # ---------- C: 開始本將 / 結束本將（座位區塊上面） ----------
     c_start, c_end, c_sp = st.columns([1, 1, 2])
     with c_start:
-        if (not mj_active) and st.button("✅ 開始本將", use_container_width=True, key="record_btn_start_mahjong"):
-            st.session_state["hand_active"] = True
-            st.session_state["seat_locked"] = True
-            st.session_state["hand_started_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            st.session_state["selected_seat"] = None
-            supabase_save(st.session_state.game_id)
-            st.rerun()
+        if not mj_active:
+            st.button("✅ 開始本將", use_container_width=True, key="record_btn_start_mahjong", on_click=_on_start_mahjong)
 
     with c_end:
         if mj_active and st.button("🏁 結束本將", use_container_width=True, key="record_btn_end_mahjong"):
-            if len(st.session_state.events) == 0:
+            if not events:
                 st.warning("本將尚無事件，無需結束。")
             else:
                 end_current_session(s)
@@ -742,76 +1785,31 @@ def page_record(s: Settings):
     hand_status_text = f"{safe_wind}{ds+1}局" if rw < 4 else "本將已結束"
     st.subheader(f"🀄 {hand_status_text} (連{dr})")
 
-    lock_note = "｜本將進行中（座位已鎖）" if mj_active else ("｜座位已鎖定" if st.session_state.get("seat_locked", False) else "")
+    lock_note = "｜本將進行中（座位已鎖）" if mj_active else ("｜座位已鎖定" if seat_locked else "")
     st.caption("莊家依局數固定：東→南→西→北（只能調整玩家座位，不可手動改莊位）。" + lock_note)
 
     st.divider()
 
     seat_map, scores_view_by_seat = _build_scores_view(s, daily_sum_df)
-    render_seat_map(s, sum_df, dealer_seat=ds, daily_sum_df=daily_sum_df, scores_view_by_seat=scores_view_by_seat)
-
-    with st.expander("DEBUG Scores Mapping", expanded=False):
-        gid = st.session_state.get("game_id", "")
-        st.write("gid:", gid)
-        st.write("seat_map:", seat_map)
-        st.write("📊 當前累計分數：", daily_sum_df)
-        st.write("scores_view_by_seat:", scores_view_by_seat)
+    _seat_panel(s, sum_df, ds, daily_sum_df, scores_view_by_seat, is_game_over)
 
-    # ---------- B: 快速輸入面板（座位區塊下方，固定不往下滑） ----------
-    qp_container = st.container()
-    with qp_container:
-        sel_seat = st.session_state.get("selected_seat")
-        if sel_seat is not None:
-            pid = s.seat_players[sel_seat]
-            st.caption(f"快速輸入（已選 {s.players[pid]}）")
-            qp_res = st.selectbox("結果", ["自摸", "胡牌", "流局"], key=f"qp_res_{pid}")
-
-            qp_tai = 0
-            if qp_res in ("自摸", "胡牌"):
-                qp_tai = st.number_input("台數", min_value=0, step=1, key=f"qp_tai_{pid}")
-
-            qp_win = pid
-            qp_lose = 0
-            if qp_res in ("自摸", "胡牌"):
-                qp_win = st.selectbox("贏家", [0, 1, 2, 3], index=pid, format_func=lambda x: s.players[x], key=f"qp_win_{pid}")
-
-            if qp_res == "胡牌":
-                lose_opts = [p for p in [0, 1, 2, 3] if p != int(qp_win)]
-                qp_lose = st.selectbox("輸家", lose_opts, format_func=lambda x: s.players[x], key=f"qp_lose_{pid}")
-
-            submit_qp = st.button("✅ 提交", use_container_width=True, key=f"qp_submit_{pid}", disabled=is_game_over)
-            if submit_qp and not is_game_over:
-                if qp_res == "胡牌" and int(qp_win) == int(qp_lose):
-                    st.error("胡牌時：贏家與輸家不能相同")
-                else:
-                    ev: Dict[str, Any] = {
-                        "_type": "hand",
-                        "result": "放槍" if qp_res == "胡牌" else qp_res,
-                        "winner_id": int(qp_win) if qp_res in ("自摸", "胡牌") else None,
-                        "loser_id": int(qp_lose) if qp_res == "胡牌" else None,
-                        "tai": int(qp_tai) if qp_res in ("自摸", "胡牌") else 0,
-                    }
-                    st.session_state.events.append(ev)
-                    st.session_state["selected_seat"] = None
-                    st.session_state["reset_hand_inputs"] = True
-                    supabase_save(st.session_state.game_id)
-                    st.rerun()
+    if debug_on:
+        with st.expander("DEBUG Scores Mapping", expanded=False):
+            st.write("gid:", ss.get("game_id", ""))
+            st.write("seat_map:", seat_map)
+            st.write("📊 當前累計分數：", daily_sum_df)
+            st.write("scores_view_by_seat:", scores_view_by_seat)
 
     st.divider()
 
     # 🔒 座位鎖定（避免手機誤觸換位；本將進行中時座位由開始本將鎖定）
-    lock_label = "🔒 鎖定座位（避免誤觸換位）" if not st.session_state.get("seat_locked", False) else "🔓 解鎖座位（可換位）"
+    lock_label = "🔒 鎖定座位（避免誤觸換位）" if not seat_locked else "🔓 解鎖座位（可換位）"
     if mj_active:
         st.caption("本將進行中：座位已鎖定，請先『結束本將』才能換位。")
 
-    if st.button(lock_label, use_container_width=True, key="record_btn_toggle_seat_lock", disabled=mj_active):
-        if not mj_active:
-            st.session_state["seat_locked"] = not bool(st.session_state.get("seat_locked", False))
-            st.session_state["selected_seat"] = None
-            supabase_save(st.session_state.game_id)
-            st.rerun()
+    st.button(lock_label, use_container_width=True, key="record_btn_toggle_seat_lock", disabled=mj_active, on_click=_on_toggle_seat_lock)
 
-    if st.session_state.get("seat_locked", False) and not mj_active:
+    if seat_locked and not mj_active:
         st.caption("✅ 目前座位已鎖定；如要換位請先按『解鎖座位』。")
 
     st.divider()
@@ -819,156 +1817,116 @@ def page_record(s: Settings):
     mode = st.radio("輸入類型", ["一般", "罰則"], horizontal=True, key="record_mode_radio")
 
     if mode == "一般":
-        if st.session_state.get("record_hand_res") == "放槍":
-            st.session_state["record_hand_res"] = "胡牌"
+        if ss.get("record_hand_res") == "放槍":
+            ss["record_hand_res"] = "胡牌"
         res = st.selectbox("結果", ["自摸", "胡牌", "流局"], key="record_hand_res")
 
-        tai = 0
+        # 數值由 _on_record_submit_hand 從 session_state 讀取
         if res in ("自摸", "胡牌"):
-            tai = st.number_input("台數", min_value=0, step=1, key="record_hand_tai")
+            st.number_input("台數", min_value=0, step=1, key="record_hand_tai")
         else:
-            st.session_state["record_hand_tai"] = 0
+            ss["record_hand_tai"] = 0
 
         win = 0
-        lose = 0
-
         if res in ("自摸", "胡牌"):
-            win = st.selectbox("贏家", [0, 1, 2, 3], format_func=lambda x: s.players[x], key="record_hand_win")
+            win = st.selectbox("贏家", [0, 1, 2, 3], format_func=fmt_player, key="record_hand_win")
 
         if res == "胡牌":
-            lose_options = [p for p in [0, 1, 2, 3] if p != int(win)]
-            cur_lose = st.session_state.get("record_hand_lose", st.session_state.get("hand_lose", 0))
-            if cur_lose == int(win):
-                st.session_state["record_hand_lose"] = lose_options[0]
-            lose = st.selectbox("輸家", lose_options, format_func=lambda x: s.players[x], key="record_hand_lose")
+            lose_options = [p for p in [0, 1, 2, 3] if p != win]
+            cur_lose = ss.get("record_hand_lose", ss.get("hand_lose", 0))
+            if cur_lose == win:
+                ss["record_hand_lose"] = lose_options[0]
+            st.selectbox("輸家", lose_options, format_func=fmt_player, key="record_hand_lose")
 
         # --- 提交按鈕區 --- #
-        submit = st.button("✅ 提交結果", use_container_width=True, key="record_btn_submit_hand", disabled=is_game_over)
-
-        if is_game_over and not st.session_state.get("_game_over_warned", False):
-            st.session_state["_game_over_warned"] = True
+        # on_click：事件在本次 rerun 開始前就寫入，頁面只算一次（不用再 st.rerun() 重跑整頁）
+        st.button("✅ 提交結果", use_container_width=True, key="record_btn_submit_hand", disabled=is_game_over, on_click=_on_record_submit_hand)
+        record_error = ss.pop("record_error", None)
+        if record_error:
+            st.error(record_error)
+
+        if is_game_over and not ss.get("_game_over_warned", False):
+            ss["_game_over_warned"] = True
             st.warning("⚠️ 本將已結束（北四局結束），錄入功能已鎖定。請封存本局或開啟新局。")
 
-        if submit and (not is_game_over):
-            if res == "胡牌" and int(win) == int(lose):
-                st.error("胡牌時：贏家與輸家不能相同")
-            else:
-                ev: Dict[str, Any] = {
-                    "_type": "hand",
-                    "result": "放槍" if res == "胡牌" else res,
-                    "winner_id": int(win) if res in ("自摸", "胡牌") else None,
-                    "loser_id": int(lose) if res == "胡牌" else None,
-                    "tai": int(tai) if res in ("自摸", "胡牌") else 0,
-                }
-                st.session_state.events.append(ev)
-                st.session_state["reset_hand_inputs"] = True
-                supabase_save(st.session_state.game_id)
-                st.rerun()
-
     else:
         pt = st.selectbox("種類", ["詐胡", "詐摸"], key="record_pen_pt")
-        off = st.selectbox("違規者", [0, 1, 2, 3], format_func=lambda x: s.players[x], key="record_pen_off")
+        st.selectbox("違規者", [0, 1, 2, 3], format_func=fmt_player, key="record_pen_off")
 
-        vic = 0
         if pt == "詐胡":
-            vic = st.selectbox("賠付對象", [0, 1, 2, 3], format_func=lambda x: s.players[x], key="record_pen_vic")
+            st.selectbox("賠付對象", [0, 1, 2, 3], format_func=fmt_player, key="record_pen_vic")
 
-        amt = st.number_input("金額", min_value=0, step=50, key="record_pen_amt")
+        st.number_input("金額", min_value=0, step=50, key="record_pen_amt")
 
-        submit_pen = st.button("🚨 提交罰則", use_container_width=True, key="record_btn_submit_pen", disabled=is_game_over)
+        st.button("🚨 提交罰則", use_container_width=True, key="record_btn_submit_pen", disabled=is_game_over, on_click=_on_record_submit_penalty)
         
-        if is_game_over and not st.session_state.get("_game_over_warned", False):
-            st.session_state["_game_over_warned"] = True
+        if is_game_over and not ss.get("_game_over_warned", False):
+            ss["_game_over_warned"] = True
             st.warning("⚠️ 本將已結束（北四局結束），錄入功能已鎖定。請封存本局或開啟新局。")
-        
-        if submit_pen and not is_game_over:
-            ev = {
-                "_type": "penalty",
-                "p_type": pt,
-                "offender_id": int(off),
-                "victim_id": int(vic),
-                "amount": int(amt),
-            }
-            st.session_state.events.append(ev)
-            st.session_state["reset_pen_inputs"] = True
-            supabase_save(st.session_state.game_id)
-            st.rerun()
 
     c1, c2 = st.columns(2)
-    if c1.button("🔙 撤銷上一筆", use_container_width=True, key="record_btn_undo"):
-        if st.session_state.events:
-            st.session_state.events.pop()
-            supabase_save(st.session_state.game_id)
-            st.rerun()
-
-    if c2.button("🧹 清空事件（只清本局事件）", use_container_width=True, key="record_btn_clear_events"):
-        st.session_state.events = []
-        st.session_state["reset_hand_inputs"] = True
-        st.session_state["reset_pen_inputs"] = True
-        supabase_save(st.session_state.game_id)
-        st.rerun()
+    c1.button("🔙 撤銷上一筆", use_container_width=True, key="record_btn_undo", on_click=_on_record_undo)
+    c2.button("🧹 清空事件（只清本局事件）", use_container_width=True, key="record_btn_clear_events", on_click=_on_record_clear_events)
 
     st.divider()
-    st.info(f"💰 累計東錢：${int(d_acc)}（已算入總分）")
+    st.info(f"💰 累計東錢：${d_acc}（已算入總分）")
 
     if not ledger_df.empty:
-        st.dataframe(ledger_df, hide_index=True, use_container_width=True)
+        render_ledger_table(ledger_df, key="record_ledger_all")
 
     st.divider()
     st.subheader("DEBUG")
-    st.session_state.debug = st.toggle("顯示 Debug", value=bool(st.session_state.debug), key="record_debug_toggle")
-    if st.session_state.debug:
-        st.write("DEBUG cloud load msg:", st.session_state.get("cloud_load_msg", ""))
-        st.write("DEBUG game_id:", st.session_state.game_id)
-        st.write(f"DEBUG events len: {len(st.session_state.events)}")
-        st.write("DEBUG sessions len:", len(st.session_state.sessions))
-        if st.session_state.events:
-            st.write("DEBUG last event:", ev_to_dict(st.session_state.events[-1]))
+    st.toggle("顯示 Debug", value=bool(ss.debug), key="record_debug_toggle", on_change=_on_debug_toggle)
+    if ss.debug:
+        st.write("DEBUG cloud load msg:", ss.get("cloud_load_msg", ""))
+        st.write("DEBUG game_id:", ss.game_id)
+        st.write("DEBUG last save:", last_save_status(ss.game_id))
+        dirty_since = ss.get("dirty_since")
+        st.write(
+            "DEBUG unsaved changes:", unsaved_changes(),
+            "for (s):", None if dirty_since is None else round(time.monotonic() - dirty_since, 1),
+        )
+        st.write(f"DEBUG events len: {len(events)}")
+        st.write("DEBUG sessions len:", len(ss.sessions))
+        if events:
+            st.write("DEBUG last event:", ev_to_dict(events[-1]))
         st.write("DEBUG seating:", s.seat_players)
         st.write("DEBUG players:", s.players)
         st.write("DEBUG steps (last 30):")
-        st.code("\n".join(debug_steps[-30:]))
+        st.code("\n".join(debug_steps[-DEBUG_STEPS_KEEP:]))
 
     st.divider()
     with st.expander("☁️ 雲端存檔 / 開新局 / 封存（放在頁面底部）", expanded=False):
         cA, cB, cC = st.columns([1, 1, 1])
 
         if cA.button("💾 立即存檔到雲端", use_container_width=True, key="cloud_save_bottom"):
-            ok, msg = supabase_save(st.session_state.game_id)
+            ok, msg = supabase_save_now(ss.game_id)
             if ok:
                 st.success("已存到雲端 ✅")
             else:
                 st.error(msg)
 
         if cB.button("🔄 從雲端重新載入", use_container_width=True, key="cloud_reload_bottom"):
-            ok, msg, data = supabase_load_latest(st.session_state.game_id)
-            if ok and data:
-                restore_state(data)
-                st.success("已從雲端載入 ✅")
-                st.rerun()
-            elif ok:
-                st.warning("雲端沒有資料（新局）")
-            else:
-                st.error(msg)
+            _reload_from_cloud(ss.game_id)
 
         with cC:
             if st.button("🆕 開新局（換 gid）", use_container_width=True, key="cloud_newgid_bottom"):
-                st.session_state["confirm_new_game"] = True
+                ss["confirm_new_game"] = True
 
-        if st.session_state.get("confirm_new_game"):
+        if ss.get("confirm_new_game"):
             st.warning("你確定要開新局嗎？（會清空目前畫面資料，但雲端歷史仍在舊 gid）")
             x1, x2 = st.columns(2)
             if x1.button("✅ 確定開新局", use_container_width=True, key="cloud_newgid_confirm"):
-                st.session_state["confirm_new_game"] = False
+                ss["confirm_new_game"] = False
                 _new_game_confirmed()
             if x2.button("取消", use_container_width=True, key="cloud_newgid_cancel"):
-                st.session_state["confirm_new_game"] = False
+                ss["confirm_new_game"] = False
 
-        st.info(f"🆔 本局 game_id：`{st.session_state.game_id}`（URL 會帶 gid，重整不會變）")
+        st.info(f"🆔 本局 game_id：`{ss.game_id}`（URL 會帶 gid，重整不會變）")
 
         b1, b2, b3 = st.columns([1, 1, 1])
         if b1.button("🏁 結束牌局（封存並新開）", use_container_width=True, key="cloud_end_session_bottom"):
-            if len(st.session_state.events) == 0:
+            if not events:
                 st.warning("目前沒有事件，無需結束。")
             else:
                 end_current_session(s)
@@ -976,26 +1934,23 @@ def page_record(s: Settings):
                 st.rerun()
 
         if b2.button("🧹 清空本局（保留封存）", use_container_width=True, key="cloud_clear_current_bottom"):
-            st.session_state.events = []
-            st.session_state["reset_hand_inputs"] = True
-            st.session_state["reset_pen_inputs"] = True
-            st.session_state.seat_locked = False
-            st.session_state.quick_actor_seat = None
-            st.session_state.quick_action = None
-            supabase_save(st.session_state.game_id)
+            clear_events()
+            ss["reset_hand_inputs"] = True
+            ss["reset_pen_inputs"] = True
+            ss.seat_locked = False
+            ss.selected_seat = None
+            mark_dirty()
             st.rerun()
 
         if b3.button("🗑️ 清空全部（本局+封存）", use_container_width=True, key="cloud_clear_all_bottom"):
-            st.session_state.events = []
-            st.session_state.sessions = []
-            st.session_state.selected_seat = None
-            st.session_state["hand_active"] = False
-            st.session_state["reset_hand_inputs"] = True
-            st.session_state["reset_pen_inputs"] = True
-            st.session_state.seat_locked = False
-            st.session_state.quick_actor_seat = None
-            st.session_state.quick_action = None
-            supabase_save(st.session_state.game_id)
+            clear_events()
+            ss.sessions = []
+            ss.selected_seat = None
+            ss["hand_active"] = False
+            ss["reset_hand_inputs"] = True
+            ss["reset_pen_inputs"] = True
+            ss.seat_locked = False
+            mark_dirty()
             st.rerun()
 
 
@@ -1003,25 +1958,25 @@ def page_overview(s: Settings):
     st.header("📊 數據總覽")
 
     # 1. 取得本局數據 (包含修正後的 rw 值)
-    ledger_df, sum_df, stats_df, rw, ds, dr, d_acc, _ = compute_game_state(s, st.session_state.events)
+    ledger_df, sum_df, stats_df, rw, ds, dr, d_acc, _ = current_game_state(s)
     
     # 2. 取得今日總計 (修正換位後分數亂掉的關鍵)
     daily_sum_df = compute_daily_total(s, cur_sum_df=sum_df)
     daily_stats_df = compute_daily_stats(s, cur_stats_df=stats_df)
     
     # 合併顯示用的表格
-    daily_merged = pd.merge(daily_sum_df, daily_stats_df, on="玩家", how="left")
-    merged = pd.merge(sum_df, stats_df, on="玩家", how="left")
+    # 兩張表都是依同一玩家順序各一列：直接用欄位陣列組成一張表，不必 merge / concat 對齊
+    daily_merged = summary_df(daily_sum_df["玩家"], daily_sum_df["總分"], daily_stats_df)
+    merged = summary_df(sum_df["玩家"], sum_df["總分"], stats_df)
     
-    # 重新對應座位分數顯示 (用於 Debug 或特定 UI)
-    seat_map, scores_view_by_seat = _build_scores_view(s, daily_sum_df)
-
-    # --- DEBUG 區塊 ---
-    with st.expander("DEBUG Scores Mapping", expanded=False):
-        gid = st.session_state.get("game_id", "")
-        st.write("gid:", gid)
-        st.write("seat_map:", seat_map)
-        st.write("scores_view_by_seat:", scores_view_by_seat)
+    # --- DEBUG 區塊（Debug 關閉時整個略過，連座位分數對照都不算） ---
+    if st.session_state.get("debug", False):
+        seat_map, scores_view_by_seat = _build_scores_view(s, daily_sum_df)
+        with st.expander("DEBUG Scores Mapping", expanded=False):
+            gid = st.session_state.get("game_id", "")
+            st.write("gid:", gid)
+            st.write("seat_map:", seat_map)
+            st.write("scores_view_by_seat:", scores_view_by_seat)
 
     # --- 第一部分：今日總結算 ---
     st.subheader("🏆 當天累計總分（所有封存 + 本將）")
@@ -1035,14 +1990,15 @@ def page_overview(s: Settings):
     safe_pos = f"{WINDS[min(rw, 3)]}{ds+1}局" if rw < 4 else "本將結束"
     game_status_text = f"📌 本局狀態：{safe_pos} (連{dr})"
     
-    st.info(f"{game_status_text} ｜ 累計東錢：${int(d_acc)}")
+    st.info(f"{game_status_text} ｜ 累計東錢：${d_acc}")
     st.dataframe(merged, hide_index=True, use_container_width=True)
 
     # 本局走勢與流水帳
     if not ledger_df.empty:
-        st.line_chart(ledger_df.set_index("#")[s.players])
-        with st.expander("查看本局流水帳明細"):
-            st.dataframe(ledger_df, hide_index=True, use_container_width=True)
+        # 直接指定 x/y 欄位，不用每次 set_index + 取欄位複製出一份新的 DataFrame
+        st.line_chart(_chart_points(ledger_df), x="#", y=s.players)
+        with st.expander(f"查看本局流水帳明細（{len(ledger_df)} 筆）"):
+            render_ledger_table(ledger_df, key="overview_ledger_all")
 
     # --- 第三部分：歷史牌局 (封存資料) ---
     st.divider()
@@ -1052,19 +2008,27 @@ def page_overview(s: Settings):
         st.caption("尚無封存的牌局。你可以在「牌局錄入」按『結束牌局』。")
         return
 
-    summary_rows = []
-    for i, sess in enumerate(st.session_state.sessions, start=1):
-        row = {
-            "#": i,
-            "結束時間": sess.get("ended_at", ""),
-            "事件數": sess.get("event_count", 0),
-            "本場東錢": sess.get("dong_total", 0),
-        }
-        for r in sess.get("sum_df", []):
-            row[r["玩家"]] = r["總分"]
-        summary_rows.append(row)
-
-    st.dataframe(pd.DataFrame(summary_rows), hide_index=True, use_container_width=True)
+    # 每場一列、每位玩家一欄：一次填進分數矩陣再建表（改過名的舊玩家名接在目前玩家後面另開欄位）
+    sessions = st.session_state.sessions
+    tables = [_session_table(sess, "sum_df", ["玩家", "總分"]) for sess in sessions]
+    names = dict.fromkeys([*s.players, *(n for t in tables for n in t["玩家"].tolist())])
+    player_idx = {name: j for j, name in enumerate(names)}
+    scores = np.zeros((len(sessions), len(player_idx)), dtype=np.int64)
+    missing = np.ones(scores.shape, dtype=bool)
+    for i, t in enumerate(tables):
+        cols = [player_idx[n] for n in t["玩家"].tolist()]
+        scores[i, cols] = t["總分"].fillna(0).to_numpy(dtype=np.int64)
+        missing[i, cols] = False
+
+    summary = {
+        "#": np.arange(1, len(sessions) + 1),
+        "結束時間": [sess.get("ended_at", "") for sess in sessions],
+        "事件數": [sess.get("event_count", 0) for sess in sessions],
+        "本場東錢": [sess.get("dong_total", 0) for sess in sessions],
+    }
+    for name, j in player_idx.items():
+        summary[name] = pd.arrays.IntegerArray(scores[:, j].copy(), missing[:, j].copy())
+    st.dataframe(pd.DataFrame(summary), hide_index=True, use_container_width=True)
 
     # 查詢單場細節
     idx = st.number_input(
@@ -1076,15 +2040,15 @@ def page_overview(s: Settings):
         key="overview_sess_idx",
     )
     
-    target_sess = st.session_state.sessions[int(idx) - 1]
+    target_sess = st.session_state.sessions[idx - 1]
     
     col_s1, col_s2 = st.columns(2)
     with col_s1:
         st.markdown("**該場：行為統計**")
-        st.dataframe(pd.DataFrame(target_sess.get("stats_df", [])), hide_index=True, use_container_width=True)
+        st.dataframe(_session_table(target_sess, "stats_df"), hide_index=True, use_container_width=True)
     with col_s2:
         st.markdown("**該場：最後 5 筆明細**")
-        st.dataframe(pd.DataFrame(target_sess.get("ledger_tail", [])).tail(5), hide_index=True, use_container_width=True)
+        st.dataframe(_session_table(target_sess, "ledger_tail").tail(5), hide_index=True, use_container_width=True)
 
 
 # ============================
@@ -1093,6 +2057,8 @@ def page_overview(s: Settings):
 def main():
     st.set_page_config(layout="wide", page_title="麻將計分系統")
     init_state()
+    # 目前 gid 寫回 localStorage：每輪最多一次，且只在 gid 與上次寫入不同時（開局、切換、新局）
+    _persist_gid_to_local_storage(st.session_state.game_id)
 
     s: Settings = st.session_state.settings
 
@@ -1106,15 +2072,15 @@ def main():
         set_mobile_layout(new_mobile_on)
 
     # Supabase status
-    if st.session_state.get("sb_client") is None:
+    if _get_supabase_client() is None:
         st.sidebar.error("Supabase 未連線：請到 Streamlit Cloud → Settings → Secrets 設定 SUPABASE_URL / SUPABASE_KEY")
     else:
         st.sidebar.success("Supabase 已連線 ✅")
 
     # ✅ Enhancement: Recent games quick switch
     with st.sidebar.expander("🕘 近期牌局（最近10局）", expanded=False):
-        recent = supabase_list_recent_game_ids(limit=10, scan_rows=200)
-        if st.session_state.get("sb_client") is None:
+        recent = supabase_list_recent_game_ids(limit=10)
+        if _get_supabase_client() is None:
             st.caption("Supabase 未連線")
         elif not recent:
             st.caption("尚無資料或抓取失敗")
@@ -1146,12 +2112,16 @@ def main():
 
     page = st.sidebar.radio("導航", ["設定", "牌局錄入", "數據總覽"], index=1, key="nav_radio")
 
-    if page == "設定":
-        page_settings(s)
-    elif page == "牌局錄入":
-        page_record(s)
-    else:
-        page_overview(s)
+    try:
+        if page == "設定":
+            page_settings(s)
+        elif page == "牌局錄入":
+            page_record(s)
+        else:
+            page_overview(s)
+    finally:
+        # 本輪 rerun 的所有變更合併成一次存檔；按鈕呼叫 st.rerun() 中斷時也會在這裡送出
+        _maybe_flush()
 
 
 if __name__ == "__main__":
@@ -1,8 +1,10 @@
 from dataclasses import dataclass, field
-from typing import List
+from typing import List, Optional
 
 
-@dataclass
+# 設定物件不可變（frozen）：修改一律用 dataclasses.replace 產生新物件再交給 set_settings，
+# 計算快取才能用「是不是同一個物件」判斷設定有沒有變。
+@dataclass(slots=True, frozen=True)
 class Settings:
     base: int = 300
     tai_value: int = 100
@@ -22,3 +24,22 @@ class Settings:
     # 確保莊家權重開關能正確序列化
     auto_dealer_bonus: bool = True
 
+
+# 錄入用的事件型別（__slots__：沒有每個實例的 __dict__）。
+# 存進 session_state / 快照的仍是 engine.ev_to_dict 投影出的標準 dict。
+@dataclass(slots=True)
+class HandEvent:
+    result: str  # 自摸 / 放槍 / 流局
+    winner_id: Optional[int] = None
+    loser_id: Optional[int] = None
+    tai: int = 0
+    _type: str = "hand"
+
+
+@dataclass(slots=True)
+class PenaltyEvent:
+    p_type: str  # 詐胡 / 詐摸
+    offender_id: int = 0
+    victim_id: int = 0
+    amount: int = 0
+    _type: str = "penalty"
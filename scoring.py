@@ -1,12 +1,13 @@
-from typing import Any
+from functools import lru_cache
+from typing import Any, Tuple
 from models import Settings
 
 
 def amount_A(settings: Settings, tai: int) -> int:
     try:
-        base = int(getattr(settings, "base", 0))
+        base = int(settings.base)
         t = int(tai)
-        tv = int(getattr(settings, "tai_value", 0))
+        tv = int(settings.tai_value)
     except Exception:
         base, t, tv = 0, 0, 0
     return base + t * tv
@@ -19,3 +20,21 @@ def dealer_bonus_tai(dealer_run: int) -> int:
     """
     return 1 + 2 * int(dealer_run)
 
+
+
+# 事件迴圈用的查表（超出範圍時呼叫端改用上面的函式）
+DEALER_BONUS_TAI: Tuple[int, ...] = tuple(dealer_bonus_tai(i) for i in range(16))
+
+
+@lru_cache(maxsize=64)
+def _amount_table(base: int, tai_value: int, size: int) -> Tuple[int, ...]:
+    return tuple(base + t * tai_value for t in range(size))
+
+
+def amount_table(settings: Settings, size: int = 32) -> Tuple[int, ...]:
+    """
+    amount_table(settings)[tai] == amount_A(settings, tai)，0 <= tai < size。
+    依 (底, 台) 快取：設定沒改時每次 rerun 都拿同一個 tuple，不再逐台呼叫 amount_A。
+    """
+    base, tv = amount_A(settings, 0), amount_A(settings, 1) - amount_A(settings, 0)
+    return _amount_table(base, tv, size)
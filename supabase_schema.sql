@@ -0,0 +1,37 @@
+-- tw-mahjong-score 的 Supabase 資料表（在 Supabase SQL Editor 執行；可重複執行）
+
+-- game_states：每局一列，存最新完整快照（App 以 on_conflict=game_id upsert、依 updated_at 排序）
+create table if not exists public.game_states (
+    game_id    text        not null,
+    state      jsonb       not null,
+    created_at timestamptz not null default now(),
+    updated_at timestamptz not null default now()
+);
+
+-- 舊版資料表升級：舊版每次存檔都 insert 一列、只有 created_at、game_id 沒有 unique 約束
+alter table public.game_states add column if not exists created_at timestamptz not null default now();
+alter table public.game_states add column if not exists updated_at timestamptz;
+update public.game_states set updated_at = created_at where updated_at is null;
+alter table public.game_states alter column updated_at set default now();
+alter table public.game_states alter column updated_at set not null;
+
+-- 每個 game_id 只留最新的一列（同時間的多列以 ctid 決定），才能加上 unique 約束
+delete from public.game_states a
+using public.game_states b
+where a.game_id = b.game_id
+  and (a.updated_at, a.ctid) < (b.updated_at, b.ctid);
+
+create unique index if not exists game_states_game_id_key on public.game_states (game_id);
+create index if not exists game_states_updated_at_idx on public.game_states (updated_at desc);
+
+-- game_events：完整快照之後補寫的事件
+--   base = game_states.state->>'snapshot_id'（事件接在哪一份快照後面）
+--   seq  = 事件在 events 中的位置（從 0 起算）
+create table if not exists public.game_events (
+    game_id    text        not null,
+    base       text        not null,
+    seq        integer     not null,
+    payload    jsonb       not null,
+    created_at timestamptz not null default now(),
+    primary key (game_id, base, seq)
+);